@@ -0,0 +1,111 @@
+import argparse
+import asyncio
+import logging
+import os
+import sys
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+from pymongo import DeleteOne, ReplaceOne
+
+import versions
+
+logger = logging.getLogger(__name__)
+
+# Completed requests whose payment settled more than ARCHIVE_AFTER_DAYS ago are
+# moved, with their transactions, to the *_archive collections. The hot
+# collections are the job's queue, so a stopped run just picks up where it left off.
+SERVICE_REQUESTS_ARCHIVE = "service_requests_archive"
+TRANSACTIONS_ARCHIVE = "transactions_archive"
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "30"))
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "500"))
+ARCHIVE_BATCH_PAUSE_SECONDS = float(os.getenv("ARCHIVE_BATCH_PAUSE_SECONDS", "0.1"))
+ARCHIVE_INTERVAL_SECONDS = float(os.getenv("ARCHIVE_INTERVAL_SECONDS", "0"))  # 0 disables the background job
+
+async def archive_batch(db, cutoff, after_id=None, batch_size=ARCHIVE_BATCH_SIZE):
+    # Returns (last transaction _id scanned, requests archived), or None once nothing is left
+    query = {"status": "completed", "_id": {"$lt": ObjectId.from_datetime(cutoff)}, "created_at": {"$lt": cutoff}}
+    if after_id is not None:
+        query["_id"]["$gt"] = after_id
+    transactions = await db.transactions.find(query).sort("_id", 1).limit(batch_size).to_list(length=batch_size)
+    if not transactions:
+        return None
+    last_id = transactions[-1]["_id"]
+
+    request_ids = [ObjectId(t["service_request_id"]) for t in transactions if ObjectId.is_valid(t.get("service_request_id"))]
+    hot = await db.service_requests.find({"_id": {"$in": request_ids}}).to_list(length=None)
+    requests = [request for request in hot if request.get("status") == "completed"]
+    settled = {str(request["_id"]) for request in requests}
+    # A run stopped between deleting the requests and deleting their transactions
+    # leaves those transactions behind with the request already archived; move them now
+    hot_ids = {request["_id"] for request in hot}
+    gone = [request_id for request_id in request_ids if request_id not in hot_ids]
+    if gone:
+        settled.update(str(request_id) for request_id in await db[SERVICE_REQUESTS_ARCHIVE].distinct("_id", {"_id": {"$in": gone}}))
+    transactions = [t for t in transactions if t.get("service_request_id") in settled]
+    if transactions:
+        # Copy first, then delete: a crash in between leaves duplicates that the
+        # next run overwrites and that merged reads already collapse
+        if requests:
+            await db[SERVICE_REQUESTS_ARCHIVE].bulk_write([ReplaceOne({"_id": r["_id"]}, r, upsert=True) for r in requests], ordered=False)
+        await db[TRANSACTIONS_ARCHIVE].bulk_write([ReplaceOne({"_id": t["_id"]}, t, upsert=True) for t in transactions], ordered=False)
+        if requests:
+            # A request written to since it was copied stays hot, together with its
+            # transaction, and is copied again on the next run
+            await db.service_requests.bulk_write([
+                DeleteOne({"_id": r["_id"], "status": "completed", "updated_at": r.get("updated_at")}) for r in requests
+            ], ordered=False)
+            still_hot = await db.service_requests.distinct("_id", {"_id": {"$in": [r["_id"] for r in requests]}})
+            if still_hot:
+                kept = {str(request_id) for request_id in still_hot}
+                requests = [r for r in requests if str(r["_id"]) not in kept]
+                transactions = [t for t in transactions if t["service_request_id"] not in kept]
+        await db.transactions.delete_many({"_id": {"$in": [t["_id"] for t in transactions]}})
+        scopes = []
+        for request in requests:
+            scopes += versions.document_scopes("service_requests", request)
+        for transaction in transactions:
+            scopes += versions.document_scopes("transactions", transaction)
+        await versions.bump(db, scopes)
+    return last_id, len(requests)
+
+async def archive(db, days=ARCHIVE_AFTER_DAYS, batch_size=ARCHIVE_BATCH_SIZE, pause=ARCHIVE_BATCH_PAUSE_SECONDS):
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    after_id = None
+    total = 0
+    while True:
+        result = await archive_batch(db, cutoff, after_id, batch_size)
+        if result is None:
+            break
+        after_id, archived = result
+        total += archived
+        # Yield between batches so live traffic keeps the connection pool
+        await asyncio.sleep(pause)
+    logger.info("Archived %d service requests settled before %s", total, cutoff)
+    return total
+
+async def run_periodically(db, interval=ARCHIVE_INTERVAL_SECONDS):
+    while True:
+        try:
+            await archive(db)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Archival run failed")
+        await asyncio.sleep(interval)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Move settled service requests and their transactions to the archive collections")
+    parser.add_argument("command", choices=["run"])
+    parser.add_argument("--days", type=int, default=ARCHIVE_AFTER_DAYS)
+    parser.add_argument("--batch-size", type=int, default=ARCHIVE_BATCH_SIZE)
+    parser.add_argument("--pause", type=float, default=ARCHIVE_BATCH_PAUSE_SECONDS)
+    args = parser.parse_args(argv)
+
+    from database import async_db
+    archived = asyncio.run(archive(async_db, args.days, args.batch_size, args.pause))
+    print(f"Archived {archived} service requests")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,74 @@
+import heapq
+import logging
+
+logger = logging.getLogger(__name__)
+
+# A request stops counting towards a mechanic's workload once it reaches one of these
+CLOSED_STATUSES = ("completed", "rejected")
+
+def is_open(status):
+    return status not in CLOSED_STATUSES
+
+class MechanicAssigner:
+    # Keeps the open-request count per mechanic in a min-heap. Entries are never
+    # updated in place: a changed count pushes a new entry and stale ones are
+    # skipped when they reach the top, so every operation is O(log n).
+    # The counts are per process and are rebuilt from Mongo on startup.
+    def __init__(self):
+        self._load = {}
+        self._emails = {}
+        self._heap = []
+
+    async def rebuild(self, db):
+        mechanics = await db.users.find({"role": "mechanic"}, {"email": 1}).to_list(length=None)
+        counts = await db.service_requests.aggregate([
+            {"$match": {"status": {"$nin": list(CLOSED_STATUSES)}}},
+            {"$group": {"_id": "$mechanic_id", "open": {"$sum": 1}}},
+        ]).to_list(length=None)
+        open_counts = {row["_id"]: row["open"] for row in counts}
+
+        self._emails = {str(m["_id"]): m["email"] for m in mechanics}
+        self._load = {mechanic_id: open_counts.get(mechanic_id, 0) for mechanic_id in self._emails}
+        self._heap = [(load, mechanic_id) for mechanic_id, load in self._load.items()]
+        heapq.heapify(self._heap)
+        logger.info("Mechanic assigner rebuilt with %d mechanics", len(self._load))
+
+    def add_mechanic(self, mechanic_id, email):
+        mechanic_id = str(mechanic_id)
+        if mechanic_id in self._load:
+            return
+        self._emails[mechanic_id] = email
+        self._set_load(mechanic_id, 0)
+
+    def assign(self):
+        # Returns (mechanic_id, email) of the least-loaded mechanic and counts the new request
+        while self._heap:
+            load, mechanic_id = self._heap[0]
+            if self._load.get(mechanic_id) == load:
+                self._set_load(mechanic_id, load + 1)
+                return mechanic_id, self._emails[mechanic_id]
+            heapq.heappop(self._heap)
+        return None
+
+    def release(self, mechanic_id):
+        load = self._load.get(mechanic_id)
+        if load:
+            self._set_load(mechanic_id, load - 1)
+
+    def on_status_change(self, mechanic_id, old_status, new_status):
+        if mechanic_id not in self._load or is_open(old_status) == is_open(new_status):
+            return
+        if is_open(new_status):
+            self._set_load(mechanic_id, self._load[mechanic_id] + 1)
+        else:
+            self.release(mechanic_id)
+
+    def _set_load(self, mechanic_id, load):
+        self._load[mechanic_id] = load
+        heapq.heappush(self._heap, (load, mechanic_id))
+        # Drop stale entries once they outnumber live ones
+        if len(self._heap) > 2 * len(self._load) + 64:
+            self._heap = [(load, mechanic_id) for mechanic_id, load in self._load.items()]
+            heapq.heapify(self._heap)
+
+assigner = MechanicAssigner()
@@ -3,14 +3,82 @@ from datetime import datetime, timedelta
 from passlib.context import CryptContext
 from fastapi import Depends, HTTPException
 from fastapi.security import OAuth2PasswordBearer
+from typing import Optional
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import asyncio
+import logging
+import multiprocessing
 import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
 
 SECRET_KEY = os.getenv("SECRET_KEY")
 ALGORITHM = os.getenv("ALGORITHM")
 ACCESS_TOKEN_EXPIRE_MINUTES = 60
+# Event stream tickets end up in URLs (access logs, browser history), so they
+# expire quickly and are refused everywhere but the event streams
+EVENT_TICKET_EXPIRE_SECONDS = int(os.getenv("EVENT_TICKET_EXPIRE_SECONDS", "60"))
+EVENT_TICKET_PURPOSE = "events"
+
+# Hashes with a different cost are upgraded transparently on the next successful login
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(max(1, (os.cpu_count() or 2) // 2))))
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", "32"))
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
+optional_oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token", auto_error=False)
+
+# Bounded LRU cache of resolved users keyed by token subject, with a TTL so
+# changes made outside the register routes are picked up eventually
+class UserCache:
+    def __init__(self, max_size, ttl_seconds):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return dict(entry[1])
+
+    def set(self, key, user):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, dict(user))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {"size": len(self._entries), "max_size": self.max_size, "hits": self.hits, "misses": self.misses}
+
+user_cache = UserCache(
+    max_size=int(os.getenv("USER_CACHE_MAX_SIZE", "10000")),
+    ttl_seconds=float(os.getenv("USER_CACHE_TTL_SECONDS", "60")),
+)
 
 def hash_password(password):
     return pwd_context.hash(password)
@@ -18,25 +86,110 @@ def hash_password(password):
 def verify_password(plain, hashed):
     return pwd_context.verify(plain, hashed)
 
+def verify_and_update_password(plain, hashed):
+    return pwd_context.verify_and_update(plain, hashed)
+
+# bcrypt runs on its own process pool so login bursts cannot starve the
+# request threadpool; once too many calls are queued we fail fast with 503
+_password_executor = None
+_password_pending = 0
+
+# The pool starts inside a running, threaded worker (event loop, Motor), where
+# forking is unsafe; forkserver/spawn children start from a clean process
+_PASSWORD_MP_CONTEXT = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+
+def _get_password_executor():
+    global _password_executor
+    if _password_executor is None:
+        _password_executor = ProcessPoolExecutor(
+            max_workers=PASSWORD_HASH_WORKERS, mp_context=multiprocessing.get_context(_PASSWORD_MP_CONTEXT)
+        )
+    return _password_executor
+
+def _replace_broken_executor(broken):
+    # A killed child breaks the whole pool; drop it so the next call starts a new one
+    global _password_executor
+    if _password_executor is broken:
+        logger.warning("Password hashing pool broke, starting a new one")
+        broken.shutdown(wait=False, cancel_futures=True)
+        _password_executor = None
+
+def shutdown_password_executor():
+    global _password_executor
+    if _password_executor is not None:
+        _password_executor.shutdown(wait=False, cancel_futures=True)
+        _password_executor = None
+
+async def _run_password_task(func, *args):
+    global _password_pending
+    if _password_pending >= PASSWORD_HASH_MAX_PENDING:
+        raise HTTPException(status_code=503, detail="Server is busy, please retry", headers={"Retry-After": "1"})
+    _password_pending += 1
+    try:
+        loop = asyncio.get_running_loop()
+        executor = _get_password_executor()
+        try:
+            return await loop.run_in_executor(executor, func, *args)
+        except BrokenProcessPool:
+            _replace_broken_executor(executor)
+            return await loop.run_in_executor(_get_password_executor(), func, *args)
+    finally:
+        _password_pending -= 1
+
+async def hash_password_async(password):
+    return await _run_password_task(hash_password, password)
+
+async def check_password(user, plain):
+    from database import async_db as db
+    valid, new_hash = await _run_password_task(verify_and_update_password, plain, user["password"])
+    if valid and new_hash:
+        await db.users.update_one({"_id": user["_id"]}, {"$set": {"password": new_hash}})
+        user_cache.invalidate(user["email"])
+    return valid
+
 def create_access_token(data: dict):
     to_encode = data.copy()
     expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     to_encode.update({"exp": expire})
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
-def get_current_user(token: str = Depends(oauth2_scheme)):
-    from database import db
+def create_event_ticket(user):
+    expire = datetime.utcnow() + timedelta(seconds=EVENT_TICKET_EXPIRE_SECONDS)
+    return jwt.encode({"sub": user["email"], "purpose": EVENT_TICKET_PURPOSE, "exp": expire}, SECRET_KEY, algorithm=ALGORITHM)
+
+async def get_current_user(token: str = Depends(oauth2_scheme)):
+    return await resolve_user(token)
+
+# Browsers' EventSource cannot send an Authorization header, so event streams
+# also accept ?ticket= with a ticket from the /events/ticket routes; the bearer
+# token itself is never accepted in the query string. The ticket is only checked
+# when the stream opens, so a reconnect after it expired needs a new one.
+async def get_event_stream_user(ticket: Optional[str] = None, header_token: Optional[str] = Depends(optional_oauth2_scheme)):
+    if header_token:
+        return await resolve_user(header_token)
+    if not ticket:
+        raise HTTPException(status_code=401, detail="Not authenticated", headers={"WWW-Authenticate": "Bearer"})
+    return await resolve_user(ticket, purpose=EVENT_TICKET_PURPOSE)
+
+async def resolve_user(token: str, purpose: Optional[str] = None):
+    from database import async_db as db
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        print(f"Decoded Payload: {payload}")  # Debug log
+        logger.debug("Decoded payload: %s", payload)
+        # Access tokens carry no purpose; a ticket is only good where it was meant for
+        if payload.get("purpose") != purpose:
+            raise HTTPException(status_code=401, detail="Invalid token")
         user_email = payload.get("sub")
         if user_email is None:
             raise HTTPException(status_code=401, detail="Invalid token")
-        user = db.users.find_one({"email": user_email})
-        print(f"User Found: {user}")  # Debug log
+        user = user_cache.get(user_email)
         if user is None:
-            raise HTTPException(status_code=401, detail="User not found")
+            user = await db.users.find_one({"email": user_email})
+            logger.debug("User found for %s: %s", user_email, user is not None)
+            if user is None:
+                raise HTTPException(status_code=401, detail="User not found")
+            user_cache.set(user_email, user)
         return user
     except JWTError as e:
-        print(f"JWT Error: {e}")  # Debug log
+        logger.debug("JWT error: %s", e)
         raise HTTPException(status_code=401, detail="Invalid token")
@@ -0,0 +1,88 @@
+"""Compare the blocking PyMongo path (bounded threadpool, as Starlette runs sync
+handlers) with the Motor path at increasing concurrency against a local mongod.
+
+    MONGO_URI=mongodb://localhost:27017 python benchmarks/bench_async_db.py
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("MONGO_URI", "mongodb://localhost:27017")
+
+from database import client_options  # noqa: E402
+from motor.motor_asyncio import AsyncIOMotorClient  # noqa: E402
+from pymongo import MongoClient  # noqa: E402
+
+BENCH_DB = "vscms_bench"
+STARLETTE_THREADPOOL_SIZE = 40
+
+def seed(db, users):
+    db.users.drop()
+    db.users.insert_many([{"email": f"user{i}@example.com", "name": f"User {i}", "role": "customer"} for i in range(users)])
+    db.users.create_index("email", unique=True)
+
+def summarize(label, concurrency, latencies, elapsed):
+    latencies.sort()
+    p99 = latencies[int(len(latencies) * 0.99) - 1]
+    print(f"{label:6} concurrency={concurrency:5} throughput={len(latencies) / elapsed:9.1f} req/s "
+          f"p50={statistics.median(latencies) * 1000:7.2f}ms p99={p99 * 1000:7.2f}ms")
+
+async def run_sync(db, concurrency, requests, users):
+    loop = asyncio.get_running_loop()
+    executor = ThreadPoolExecutor(max_workers=STARLETTE_THREADPOOL_SIZE)
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    def lookup(i):
+        return db.users.find_one({"email": f"user{i % users}@example.com"})
+
+    async def one(i):
+        async with semaphore:
+            start = time.perf_counter()
+            await loop.run_in_executor(executor, lookup, i)
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    summarize("sync", concurrency, latencies, time.perf_counter() - start)
+    executor.shutdown()
+
+async def run_async(db, concurrency, requests, users):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one(i):
+        async with semaphore:
+            start = time.perf_counter()
+            await db.users.find_one({"email": f"user{i % users}@example.com"})
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    summarize("async", concurrency, latencies, time.perf_counter() - start)
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[10, 40, 100, 400, 1000])
+    args = parser.parse_args()
+
+    uri = os.environ["MONGO_URI"]
+    sync_db = MongoClient(uri, **client_options())[BENCH_DB]
+    async_db = AsyncIOMotorClient(uri, **client_options())[BENCH_DB]
+    seed(sync_db, args.users)
+
+    for concurrency in args.concurrency:
+        await run_sync(sync_db, concurrency, args.requests, args.users)
+        await run_async(async_db, concurrency, args.requests, args.users)
+
+    sync_db.client.drop_database(BENCH_DB)
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,158 @@
+"""Latency of the admin service request search on a large seeded collection.
+
+Seeds --documents service requests (one million by default) into a dedicated
+database on a local mongod, builds the indexes from indexes.INDEXES and runs
+every filter combination /admin/search_service_requests accepts: ranked text
+search, structured vehicle filters and both combined. Prints p50/p95/p99 per
+shape, the winning plan stages and whether p95 meets the --target-ms budget;
+a newest-first shape whose plan sorts in memory fails regardless of latency.
+
+    MONGO_URI=mongodb://localhost:27017 python benchmarks/bench_search.py
+    python benchmarks/bench_search.py --skip-seed   # reuse the previous seed
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("MONGO_URI", "mongodb://localhost:27017")
+
+from bson import ObjectId, SON  # noqa: E402
+from pymongo import MongoClient  # noqa: E402
+
+from database import client_options  # noqa: E402
+from indexes import INDEXES, _plan_stages  # noqa: E402
+
+BENCH_DB = "vscms_search_bench"
+PAGE_SIZE = 100
+NEWEST_FIRST = [("_id", -1)]
+
+VEHICLES = {
+    "Toyota": ["Corolla", "Camry", "RAV4", "Hilux", "Yaris", "Prius"],
+    "Honda": ["Civic", "Accord", "CR-V", "Jazz", "Pilot"],
+    "Ford": ["Focus", "Fiesta", "Ranger", "Mustang", "Transit"],
+    "Volkswagen": ["Golf", "Polo", "Passat", "Tiguan"],
+    "BMW": ["320i", "X3", "X5", "M3"],
+    "Hyundai": ["i20", "Elantra", "Tucson", "Kona"],
+    "Nissan": ["Altima", "Leaf", "Navara", "Qashqai"],
+    "Kia": ["Rio", "Sportage", "Sorento", "Picanto"],
+}
+SERVICE_TYPES = [
+    "Oil change", "Brake service", "Tyre rotation", "Battery replacement", "Inspection", "Wheel alignment",
+    "Transmission repair", "Air conditioning", "Suspension repair", "Exhaust repair", "Clutch replacement",
+    "Timing belt", "Coolant flush", "Spark plugs", "Windscreen replacement",
+]
+SYMPTOMS = [
+    "squealing brakes", "grinding noise when braking", "engine misfire", "check engine light", "oil leak",
+    "coolant leak", "overheating", "rough idle", "vibration at speed", "pulls to the left", "pulls to the right",
+    "clunking over bumps", "flat battery", "slow crank", "gearbox slipping", "hard to shift", "weak air conditioning",
+    "noisy exhaust", "worn tyres", "cracked windscreen", "burning smell", "steering wheel shake", "warning light",
+]
+STATUSES = ["pending", "in_progress", "verified", "completed", "completed", "completed"]
+
+def seed(db, documents, batch_size=10000):
+    db.service_requests.drop()
+    rng = random.Random(19)
+    makes = list(VEHICLES)
+    now = datetime.utcnow()
+    start = time.perf_counter()
+    batch = []
+    for i in range(documents):
+        make = rng.choice(makes)
+        batch.append({
+            "_id": ObjectId(),
+            "service_type": rng.choice(SERVICE_TYPES),
+            "description": f"{rng.choice(SYMPTOMS)}, {rng.choice(SYMPTOMS)} (ref {i})",
+            "vehicle": {"make": make, "model": rng.choice(VEHICLES[make]), "year": rng.randint(2000, 2024)},
+            "customer_id": str(ObjectId()),
+            "mechanic_id": str(ObjectId()),
+            "status": rng.choice(STATUSES),
+            "created_at": now - timedelta(minutes=i),
+        })
+        if len(batch) == batch_size:
+            db.service_requests.insert_many(batch, ordered=False)
+            batch = []
+    if batch:
+        db.service_requests.insert_many(batch, ordered=False)
+    print(f"Seeded {documents} documents in {time.perf_counter() - start:.1f}s")
+    start = time.perf_counter()
+    db.service_requests.create_indexes(INDEXES["service_requests"])
+    print(f"Built indexes in {time.perf_counter() - start:.1f}s")
+
+def query_shapes():
+    score = {"$meta": "textScore"}
+    ranked = [("score", score), ("_id", -1)]
+    text = {"$search": "oil leak"}
+    # Every filter combination /admin/search_service_requests accepts: q with
+    # any of the others, or make with any of model, year and status
+    return [
+        ("text: rare term", {"$text": {"$search": "windscreen cracked"}}, {"score": score}, ranked),
+        ("text: service type", {"$text": {"$search": "clutch"}}, {"score": score}, ranked),
+        ("text: make + symptom", {"$text": {"$search": "hilux overheating"}}, {"score": score}, ranked),
+        ("text + status", {"$text": text, "status": "pending"}, {"score": score}, ranked),
+        ("text + make", {"$text": text, "vehicle.make": "Ford"}, {"score": score}, ranked),
+        ("text + model", {"$text": text, "vehicle.model": "Ranger"}, {"score": score}, ranked),
+        ("text + year", {"$text": text, "vehicle.year": 2015}, {"score": score}, ranked),
+        ("text + make/model", {"$text": text, "vehicle.make": "Ford", "vehicle.model": "Ranger"}, {"score": score}, ranked),
+        ("text + make/model/year/status", {"$text": text, "vehicle.make": "Ford", "vehicle.model": "Ranger", "vehicle.year": 2015, "status": "pending"}, {"score": score}, ranked),
+        ("make", {"vehicle.make": "BMW"}, None, NEWEST_FIRST),
+        ("make + status", {"vehicle.make": "BMW", "status": "pending"}, None, NEWEST_FIRST),
+        ("make + year", {"vehicle.make": "Nissan", "vehicle.year": 2012}, None, NEWEST_FIRST),
+        ("make + year + status", {"vehicle.make": "Nissan", "vehicle.year": 2012, "status": "in_progress"}, None, NEWEST_FIRST),
+        ("make + model", {"vehicle.make": "Toyota", "vehicle.model": "Corolla"}, None, NEWEST_FIRST),
+        ("make + model + status", {"vehicle.make": "Toyota", "vehicle.model": "Corolla", "status": "verified"}, None, NEWEST_FIRST),
+        ("make + model + year", {"vehicle.make": "Honda", "vehicle.model": "Civic", "vehicle.year": 2015}, None, NEWEST_FIRST),
+        ("make + model + year + status", {"vehicle.make": "Kia", "vehicle.model": "Rio", "vehicle.year": 2010, "status": "pending"}, None, NEWEST_FIRST),
+    ]
+
+def percentile(sorted_values, fraction):
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+def explain_stages(db, query, projection, sort):
+    command = SON([("find", "service_requests"), ("filter", query), ("sort", SON(sort)), ("limit", PAGE_SIZE + 1)])
+    if projection:
+        command["projection"] = projection
+    explain = db.command("explain", command, verbosity="queryPlanner")
+    return list(_plan_stages(explain["queryPlanner"]["winningPlan"]))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--documents", type=int, default=1_000_000)
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--target-ms", type=float, default=50.0)
+    parser.add_argument("--skip-seed", action="store_true")
+    parser.add_argument("--drop", action="store_true", help="drop the benchmark database afterwards")
+    args = parser.parse_args()
+
+    client = MongoClient(os.environ["MONGO_URI"], **client_options())
+    db = client[BENCH_DB]
+    if not args.skip_seed:
+        seed(db, args.documents)
+
+    failures = 0
+    for label, query, projection, sort in query_shapes():
+        latencies = []
+        for _ in range(args.iterations):
+            start = time.perf_counter()
+            list(db.service_requests.find(query, projection).sort(sort).limit(PAGE_SIZE + 1))
+            latencies.append((time.perf_counter() - start) * 1000)
+        latencies.sort()
+        p95 = percentile(latencies, 0.95)
+        stages = explain_stages(db, query, projection, sort)
+        # Ranked text results are always sorted in memory; newest-first pages must come from the index
+        blocking_sort = sort == NEWEST_FIRST and "SORT" in stages
+        ok = p95 <= args.target_ms and not blocking_sort
+        failures += not ok
+        print(f"{label:32} p50={percentile(latencies, 0.50):7.2f}ms p95={p95:7.2f}ms p99={percentile(latencies, 0.99):7.2f}ms "
+              f"{'OK ' if ok else 'SORT' if blocking_sort else 'SLOW'} {'>'.join(stages)}")
+
+    if args.drop:
+        client.drop_database(BENCH_DB)
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,73 @@
+"""Compare the old list-route serialization path (per-field str() loop, then
+jsonable_encoder and json.dumps via JSONResponse) with serialization.BSONResponse.
+
+    python benchmarks/bench_serialization.py --sizes 10000 100000
+"""
+import argparse
+import copy
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bson import ObjectId  # noqa: E402
+from fastapi.encoders import jsonable_encoder  # noqa: E402
+from fastapi.responses import JSONResponse  # noqa: E402
+
+from serialization import BSONResponse  # noqa: E402
+
+def make_documents(count):
+    now = datetime.utcnow()
+    return [
+        {
+            "_id": ObjectId(),
+            "service_type": "Oil change",
+            "description": "Replace oil and filter, check brake pads",
+            "vehicle": {"make": "Toyota", "model": "Corolla", "year": 2015 + i % 8},
+            "customer_id": str(ObjectId()),
+            "mechanic_id": str(ObjectId()),
+            "status": "completed" if i % 3 else "pending",
+            "created_at": now - timedelta(minutes=i),
+            "updated_at": now,
+            "bill": {"amount": 120.5, "description": "Parts and labour"},
+            "inventories": [{"item_name": "Oil filter", "quantity_used": 1}],
+        }
+        for i in range(count)
+    ]
+
+def legacy_path(docs):
+    for req in docs:
+        req["_id"] = str(req["_id"])
+        if "customer_id" in req:
+            req["customer_id"] = str(req["customer_id"])
+    return JSONResponse(jsonable_encoder({"service_requests": docs})).body
+
+def bson_path(docs):
+    return BSONResponse({"service_requests": docs}).body
+
+def timed(func, docs, repeat):
+    best = None
+    for _ in range(repeat):
+        sample = copy.deepcopy(docs)
+        start = time.perf_counter()
+        func(sample)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    for size in args.sizes:
+        docs = make_documents(size)
+        legacy = timed(legacy_path, docs, args.repeat)
+        fast = timed(bson_path, docs, args.repeat)
+        print(f"{size:7} docs  legacy={legacy * 1000:9.1f}ms  bson={fast * 1000:8.1f}ms  speedup={legacy / fast:5.1f}x")
+
+if __name__ == "__main__":
+    main()
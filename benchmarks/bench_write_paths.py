@@ -0,0 +1,194 @@
+"""Compare the old read-then-write route bodies with the single guarded
+find_one_and_update versions against a local mongod: latency, throughput and
+Mongo commands per write, plus how many duplicate payments slip through when
+the same request is paid concurrently.
+
+"after" calls the real route handlers; "before" is the route body as it was
+before the guarded writes (a find_one, then an unguarded update or insert),
+kept here as the baseline. Both run the same lifecycle hooks (rollups, list
+versions, assigner and events) against the same database, so the difference
+is the route's own reads and writes.
+
+    MONGO_URI=mongodb://localhost:27017 python benchmarks/bench_write_paths.py
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import threading
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("MONGO_URI", "mongodb://localhost:27017")
+os.environ["MONGO_DB_NAME"] = "vscms_bench"
+os.environ.setdefault("SECRET_KEY", "bench-secret")
+os.environ.setdefault("ALGORITHM", "HS256")
+
+from bson import ObjectId  # noqa: E402
+from fastapi import HTTPException  # noqa: E402
+from pymongo import monitoring  # noqa: E402
+
+class CommandCounter(monitoring.CommandListener):
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def started(self, event):
+        with self._lock:
+            self.count += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+# Must be registered before the route modules create their client
+counter = CommandCounter()
+monitoring.register(counter)
+
+import lifecycle  # noqa: E402
+from database import async_db  # noqa: E402
+from indexes import ensure_indexes_async  # noqa: E402
+from routes import admin, customer, mechanic  # noqa: E402
+
+MECHANIC = {"_id": ObjectId(), "role": "mechanic"}
+CUSTOMER = {"_id": ObjectId(), "role": "customer"}
+ADMIN = {"_id": ObjectId(), "role": "admin"}
+BILL = 100.0
+PAID_UNIQUE = "service_request_id_paid_unique"
+
+async def seed(db, requests):
+    for name in ("service_requests", "transactions", "rollups_daily", "rollups_workload", "versions"):
+        await db[name].drop()
+    await ensure_indexes_async(db)
+    docs = [
+        {"_id": ObjectId(), "customer_id": str(CUSTOMER["_id"]), "mechanic_id": str(MECHANIC["_id"]),
+         "service_type": "Oil change", "status": "pending", "bill": {"amount": BILL, "description": "Seeded bill"},
+         "created_at": datetime.utcnow(), "updated_at": datetime.utcnow()}
+        for _ in range(requests)
+    ]
+    await db.service_requests.insert_many(docs)
+    return [str(doc["_id"]) for doc in docs]
+
+# Route bodies before the guarded writes
+async def complete_before(db, request_id):
+    service_request = await db.service_requests.find_one({"_id": ObjectId(request_id)})
+    if not service_request:
+        raise HTTPException(status_code=404, detail="Service request not found")
+    await db.service_requests.update_one(
+        {"_id": ObjectId(request_id)}, {"$set": {"status": "completed", "updated_at": datetime.utcnow()}}
+    )
+    await lifecycle.status_changed(service_request, "completed")
+
+async def verify_before(db, request_id):
+    service_request = await db.service_requests.find_one({"_id": ObjectId(request_id)})
+    if not service_request:
+        raise HTTPException(status_code=404, detail="Service request not found")
+    await db.service_requests.update_one(
+        {"_id": ObjectId(request_id)}, {"$set": {"status": "verified", "updated_at": datetime.utcnow()}}
+    )
+    await lifecycle.status_changed(service_request, "verified")
+
+async def bill_before(db, request_id):
+    service_request = await db.service_requests.find_one({"_id": ObjectId(request_id)})
+    if not service_request:
+        raise HTTPException(status_code=404, detail="Service request not found")
+    bill_data = {"amount": BILL, "description": "Bench bill"}
+    now = datetime.utcnow()
+    result = await db.service_requests.update_one(
+        {"_id": ObjectId(request_id)}, {"$set": {"bill": bill_data, "billed_at": now, "updated_at": now}}
+    )
+    if result.matched_count == 0:
+        raise HTTPException(status_code=404, detail="Failed to generate bill")
+    await lifecycle.bill_generated(service_request, bill_data)
+
+async def pay_before(db, request_id):
+    service_request = await db.service_requests.find_one({"_id": ObjectId(request_id), "customer_id": str(CUSTOMER["_id"])})
+    if not service_request:
+        raise HTTPException(status_code=404, detail="Service request not found or does not belong to the customer")
+    transaction_data = {
+        "customer_id": str(CUSTOMER["_id"]), "service_request_id": request_id, "amount": BILL,
+        "payment_method": "credit_card", "status": "completed", "created_at": datetime.utcnow(),
+    }
+    transaction_data["_id"] = str((await db.transactions.insert_one(transaction_data)).inserted_id)
+    await lifecycle.payment_completed(service_request, transaction_data)
+
+# The real route handlers, which use the app's client on the same database
+async def complete_after(db, request_id):
+    await mechanic.mark_as_complete(request_id, user=MECHANIC)
+
+async def verify_after(db, request_id):
+    await admin.verify_request(request_id, admin.VerifyRequestModel(verified=True), user=ADMIN)
+
+async def bill_after(db, request_id):
+    await admin.generate_bill(admin.BillModel(service_request_id=request_id, amount=BILL, description="Bench bill"), user=ADMIN)
+
+async def pay_after(db, request_id):
+    payment = customer.PaymentModel(service_request_id=request_id, amount=BILL, payment_method="credit_card")
+    try:
+        await customer.initiate_payment(payment, user=CUSTOMER)
+    except HTTPException as e:
+        if e.status_code != 409:
+            raise
+
+ROUTES = (
+    ("mark_as_complete", complete_before, complete_after),
+    ("verify_request", verify_before, verify_after),
+    ("generate_bill", bill_before, bill_after),
+    ("initiate_payment", pay_before, pay_after),
+)
+
+async def measure(label, db, write, request_ids, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one(request_id):
+        async with semaphore:
+            start = time.perf_counter()
+            await write(db, request_id)
+            latencies.append(time.perf_counter() - start)
+
+    commands_before = counter.count
+    start = time.perf_counter()
+    await asyncio.gather(*(one(request_id) for request_id in request_ids))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    p99 = latencies[max(0, int(len(latencies) * 0.99) - 1)]
+    print(f"{label:26} concurrency={concurrency:4} throughput={len(latencies) / elapsed:9.1f} writes/s "
+          f"p50={statistics.median(latencies) * 1000:7.2f}ms p99={p99 * 1000:7.2f}ms "
+          f"commands/write={(counter.count - commands_before) / len(latencies):.2f}")
+
+async def duplicate_payments(db, label, pay, request_ids, attempts):
+    await asyncio.gather(*(pay(db, request_id) for request_id in request_ids for _ in range(attempts)))
+    paid = await db.transactions.count_documents({"status": "completed"})
+    print(f"concurrent payments ({label}): {len(request_ids)} requests x {attempts} attempts -> {paid} completed transactions")
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 10, 100])
+    parser.add_argument("--payment-attempts", type=int, default=5)
+    args = parser.parse_args()
+    db = async_db
+
+    for concurrency in args.concurrency:
+        for name, before, after in ROUTES:
+            for label, write in (("before", before), ("after", after)):
+                request_ids = await seed(db, args.requests)
+                await measure(f"{name} {label}", db, write, request_ids, concurrency)
+
+    # Before: no unique index, so nothing stops a second payment
+    request_ids = await seed(db, 100)
+    await db.transactions.drop_index(PAID_UNIQUE)
+    await duplicate_payments(db, "before", pay_before, request_ids, args.payment_attempts)
+    request_ids = await seed(db, 100)
+    await duplicate_payments(db, "after", pay_after, request_ids, args.payment_attempts)
+
+    await db.client.drop_database(db.name)
+    db.close()
+
+if __name__ == "__main__":
+    asyncio.run(main())
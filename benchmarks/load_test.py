@@ -0,0 +1,276 @@
+"""Reproducible load test for the API routes.
+
+Seeds a dedicated database on a local mongod, mints a JWT per role and drives
+each route in-process (or against --base-url) at the requested concurrency
+levels. Reports p50/p95/p99 latency, throughput and Mongo commands per request,
+and writes everything to a JSON file so runs can be compared across commits.
+Requires httpx.
+
+    MONGO_URI=mongodb://localhost:27017 python benchmarks/load_test.py run --output before.json
+    python benchmarks/load_test.py compare before.json after.json
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("MONGO_URI", "mongodb://localhost:27017")
+os.environ.setdefault("MONGO_DB_NAME", "vscms_load_test")
+os.environ.setdefault("SECRET_KEY", "load-test-secret")
+os.environ.setdefault("ALGORITHM", "HS256")
+# Every simulated user logs in from one address; lift the per-IP throttle so the
+# login scenario keeps measuring bcrypt throughput rather than 429s
+os.environ.setdefault("LOGIN_RATE_PER_IP", "1000000000")
+
+from pymongo import monitoring  # noqa: E402
+
+class CommandCounter(monitoring.CommandListener):
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def started(self, event):
+        with self._lock:
+            self.count += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+# Must be registered before any client is created
+command_counter = CommandCounter()
+monitoring.register(command_counter)
+
+import httpx  # noqa: E402
+from bson import ObjectId  # noqa: E402
+
+from auth import create_access_token, hash_password  # noqa: E402
+from database import db  # noqa: E402
+
+PASSWORD = "load-test-password"
+SERVICE_TYPES = ["Oil change", "Brake service", "Tyre rotation", "Battery replacement", "Inspection"]
+STATUSES = ["pending", "in_progress", "verified", "completed", "completed", "completed"]
+
+def seed(customers, mechanics, admins, requests, transactions):
+    for name in ("users", "service_requests", "transactions", "service_requests_archive", "transactions_archive", "inventory", "inventory_stock", "inventory_usage_daily", "rollups_daily", "rollups_workload", "versions"):
+        db[name].drop()
+
+    password = hash_password(PASSWORD)
+    users = []
+    for role, count in (("customer", customers), ("mechanic", mechanics), ("admin", admins)):
+        users += [{"_id": ObjectId(), "email": f"{role}{i}@example.com", "name": f"{role} {i}", "role": role, "password": password} for i in range(count)]
+    db.users.insert_many(users)
+    customer_ids = [str(u["_id"]) for u in users if u["role"] == "customer"]
+    mechanic_ids = [str(u["_id"]) for u in users if u["role"] == "mechanic"]
+
+    now = datetime.utcnow()
+    rng = random.Random(42)
+    batch = []
+    request_docs = []
+    for i in range(requests):
+        doc = {
+            "_id": ObjectId(),
+            "service_type": rng.choice(SERVICE_TYPES),
+            "description": f"Seeded request {i}",
+            "vehicle": {"make": "Toyota", "model": "Corolla", "year": 2010 + i % 14},
+            "customer_id": rng.choice(customer_ids),
+            "mechanic_id": rng.choice(mechanic_ids),
+            "status": rng.choice(STATUSES),
+            "created_at": now - timedelta(minutes=i),
+        }
+        if doc["status"] == "completed":
+            doc["bill"] = {"amount": 100.0, "description": "Seeded bill"}
+        request_docs.append(doc)
+        batch.append(doc)
+        if len(batch) == 10000:
+            db.service_requests.insert_many(batch)
+            batch = []
+    if batch:
+        db.service_requests.insert_many(batch)
+
+    billed = [doc for doc in request_docs if "bill" in doc][:transactions]
+    if billed:
+        db.transactions.insert_many([
+            {
+                "customer_id": doc["customer_id"],
+                "service_request_id": str(doc["_id"]),
+                "amount": doc["bill"]["amount"],
+                "payment_method": "credit_card",
+                "status": "completed",
+                "created_at": doc["created_at"] + timedelta(hours=1),
+            }
+            for doc in billed
+        ])
+
+    import rollups
+    from indexes import ensure_indexes
+    ensure_indexes(db)
+    rollups.rebuild(db)
+    return {"customers": customers, "mechanics": mechanics, "admins": admins, "requests": requests, "transactions": len(billed)}
+
+def tokens_for(role, count):
+    return [create_access_token({"sub": f"{role}{i}@example.com", "role": role}) for i in range(count)]
+
+def scenarios():
+    vehicle = {"make": "Honda", "model": "Civic", "year": 2018}
+    return [
+        ("customer", "GET", "/customer/service_requests", None),
+        ("customer", "GET", "/customer/completed_transactions", None),
+        ("customer", "POST", "/customer/schedule_service", {"service_type": "Oil change", "description": "Load test", "vehicle": vehicle}),
+        ("login:customer", "POST", "/customer/login", None),
+        ("mechanic", "GET", "/mechanic/assigned_requests", None),
+        ("mechanic", "GET", "/mechanic/completed_requests", None),
+        ("admin", "GET", "/admin/service_requests", None),
+        ("admin", "GET", "/admin/completed_requests", None),
+        ("admin", "GET", "/admin/completed_transactions", None),
+        ("admin", "GET", "/admin/dashboard/revenue?start=2000-01-01&end=2100-01-01", None),
+        ("admin", "GET", "/admin/dashboard/workload", None),
+    ]
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+async def drive(client, role, method, path, body, tokens, user_count, concurrency, total):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    statuses = {}
+
+    async def one(i):
+        if role.startswith("login:"):
+            login_role = role.split(":", 1)[1]
+            kwargs = {"json": {"email": f"{login_role}{i % user_count[login_role]}@example.com", "password": PASSWORD}}
+        else:
+            kwargs = {"headers": {"Authorization": "Bearer " + tokens[role][i % len(tokens[role])]}}
+            if body is not None:
+                kwargs["json"] = body
+        async with semaphore:
+            start = time.perf_counter()
+            response = await client.request(method, path, **kwargs)
+            latencies.append(time.perf_counter() - start)
+        statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+    commands_before = command_counter.count
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(total)))
+    elapsed = time.perf_counter() - start
+    commands = command_counter.count - commands_before
+
+    latencies.sort()
+    return {
+        "route": f"{method} {path}",
+        "role": role,
+        "concurrency": concurrency,
+        "requests": total,
+        "throughput_rps": round(total / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+        "status_codes": {str(code): count for code, count in sorted(statuses.items())},
+        "mongo_commands_per_request": round(commands / total, 2),
+    }
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+async def run(args):
+    seeded = None
+    if not args.skip_seed:
+        seeded = seed(args.customers, args.mechanics, args.admins, args.service_requests, args.transactions)
+    user_count = {"customer": args.customers, "mechanic": args.mechanics, "admin": args.admins}
+    tokens = {role: tokens_for(role, min(count, 1000)) for role, count in user_count.items()}
+
+    lifespan = contextlib.nullcontext()
+    if args.base_url:
+        client = httpx.AsyncClient(base_url=args.base_url, timeout=60)
+    else:
+        from main import app
+        lifespan = app.router.lifespan_context(app)
+        client = httpx.AsyncClient(app=app, base_url="http://load-test", timeout=60)
+
+    results = []
+    async with lifespan, client:
+        for role, method, path, body in scenarios():
+            if args.routes and not any(fragment in path for fragment in args.routes):
+                continue
+            for concurrency in args.concurrency:
+                result = await drive(client, role, method, path, body, tokens, user_count, concurrency, args.requests)
+                if args.base_url:
+                    result["mongo_commands_per_request"] = None
+                results.append(result)
+                print(f"{result['route']:60} c={concurrency:4} {result['throughput_rps']:9.1f} req/s "
+                      f"p50={result['p50_ms']:8.2f} p95={result['p95_ms']:8.2f} p99={result['p99_ms']:8.2f}ms "
+                      f"mongo/req={result['mongo_commands_per_request']} {result['status_codes']}")
+
+    report = {
+        "revision": git_revision(),
+        "timestamp": datetime.utcnow().isoformat(),
+        "seed": seeded,
+        "config": {"concurrency": args.concurrency, "requests": args.requests, "base_url": args.base_url},
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {args.output}")
+
+def compare(args):
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.candidate) as f:
+        candidate = json.load(f)
+    previous = {(r["route"], r["concurrency"]): r for r in baseline["results"]}
+    print(f"{baseline.get('revision')} -> {candidate.get('revision')}")
+    for result in candidate["results"]:
+        before = previous.get((result["route"], result["concurrency"]))
+        if before is None:
+            continue
+        change = (result["p95_ms"] - before["p95_ms"]) / before["p95_ms"] * 100 if before["p95_ms"] else 0.0
+        print(f"{result['route']:60} c={result['concurrency']:4} p95 {before['p95_ms']:8.2f} -> {result['p95_ms']:8.2f}ms "
+              f"({change:+6.1f}%)  rps {before['throughput_rps']:9.1f} -> {result['throughput_rps']:9.1f}  "
+              f"mongo/req {before['mongo_commands_per_request']} -> {result['mongo_commands_per_request']}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="seed the database and drive every route")
+    run_parser.add_argument("--customers", type=int, default=1000)
+    run_parser.add_argument("--mechanics", type=int, default=50)
+    run_parser.add_argument("--admins", type=int, default=5)
+    run_parser.add_argument("--service-requests", type=int, default=100000)
+    run_parser.add_argument("--transactions", type=int, default=50000)
+    run_parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 10, 50])
+    run_parser.add_argument("--requests", type=int, default=500, help="requests per route and concurrency level")
+    run_parser.add_argument("--routes", nargs="*", help="only run routes whose path contains one of these fragments")
+    run_parser.add_argument("--base-url", help="drive a running server (started with the same MONGO_DB_NAME) instead of the in-process app")
+    run_parser.add_argument("--skip-seed", action="store_true", help="reuse the data from a previous run")
+    run_parser.add_argument("--output", default="bench_output.json")
+
+    compare_parser = commands.add_parser("compare", help="compare two result files")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("candidate")
+
+    args = parser.parse_args()
+    if args.command == "run":
+        asyncio.run(run(args))
+    else:
+        compare(args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+from datetime import datetime
+
+from bson import ObjectId
+from fastapi import HTTPException
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+MAX_BULK_ITEMS = 1000
+
+def check_batch_size(items):
+    if not items:
+        raise HTTPException(status_code=400, detail="At least one item is required")
+    if len(items) > MAX_BULK_ITEMS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BULK_ITEMS} items are allowed per call")
+
+def _stored(value):
+    # Mongo keeps datetimes to the millisecond
+    return value.replace(microsecond=value.microsecond // 1000 * 1000) if isinstance(value, datetime) else value
+
+def write_errors_by_index(error: BulkWriteError):
+    return {err["index"]: err.get("errmsg", "Write failed") for err in error.details.get("writeErrors", [])}
+
+async def bulk_update_by_id(collection, updates, on_updated=None, guard=None,
+                            conflict="Service request cannot be updated in its current state"):
+    # updates: list of (document id string, fields to $set); guard: extra filter
+    # every document must match, e.g. lifecycle.OPEN. Returns one result per
+    # input item, in input order.
+    # One find reads the documents as they are now, then one unordered bulk_write
+    # applies every update pinned on that state (compare-and-set on the projected
+    # fields), so the on_updated([(previous, fields), ...]) hook sees the real
+    # transition: a document another request changed in between is not written.
+    # A bulk_write only reports how many updates matched in total, so when some
+    # did not (guard miss or concurrent change) one more find tells which did.
+    results = [{"request_id": request_id} for request_id, _ in updates]
+    projection = {field: 1 for _, fields in updates for field in fields}
+    projection.update(status=1, customer_id=1, mechanic_id=1, service_type=1)
+
+    items, seen = {}, set()
+    for index, (request_id, _) in enumerate(updates):
+        if not ObjectId.is_valid(request_id):
+            results[index].update(matched=0, modified=0, error="Invalid request id")
+        elif ObjectId(request_id) in seen:
+            # A second write would be pinned on the state the first one replaces
+            results[index].update(matched=0, modified=0, error="Duplicate request id in batch")
+        else:
+            items[index] = ObjectId(request_id)
+            seen.add(items[index])
+    documents = await collection.find({"_id": {"$in": list(items.values())}}, projection).to_list(length=None)
+    current = {document["_id"]: document for document in documents}
+
+    operations, op_items = [], []
+    for index, object_id in items.items():
+        previous = current.get(object_id)
+        if previous is None:
+            results[index].update(matched=0, modified=0, error="Service request not found")
+            continue
+        query = {"_id": object_id, **{field: previous.get(field) for field in projection}}
+        if guard:
+            query = {"$and": [query, guard]}
+        operations.append(UpdateOne(query, {"$set": updates[index][1]}))
+        op_items.append(index)
+
+    matched, failed = 0, {}
+    if operations:
+        try:
+            matched = (await collection.bulk_write(operations, ordered=False)).matched_count
+        except BulkWriteError as e:
+            matched = e.details.get("nMatched", 0)
+            failed = write_errors_by_index(e)
+
+    missed = set()
+    if len(op_items) - len(failed) > matched:
+        # Written documents now hold the fields that were set
+        candidates = [items[index] for op_index, index in enumerate(op_items) if op_index not in failed]
+        after = {document["_id"]: document for document in await collection.find({"_id": {"$in": candidates}}, projection).to_list(length=None)}
+        for op_index, index in enumerate(op_items):
+            document = after.get(items[index])
+            if op_index not in failed and (document is None or any(document.get(field) != _stored(value) for field, value in updates[index][1].items())):
+                missed.add(index)
+
+    applied = []
+    for op_index, index in enumerate(op_items):
+        if op_index in failed:
+            results[index].update(matched=0, modified=0, error=failed[op_index])
+        elif index in missed:
+            results[index].update(matched=0, modified=0, error=conflict)
+        else:
+            previous = current[items[index]]
+            fields = updates[index][1]
+            changed = any(previous.get(field) != value for field, value in fields.items() if field != "updated_at")
+            results[index].update(matched=1, modified=int(changed))
+            applied.append((previous, fields))
+
+    if on_updated is not None and applied:
+        await on_updated(applied)
+
+    return {
+        "matched": sum(result["matched"] for result in results),
+        "modified": sum(result["modified"] for result in results),
+        "results": results,
+    }
@@ -0,0 +1,112 @@
+import asyncio
+from datetime import datetime, timedelta
+
+from fastapi import HTTPException
+
+import inventory
+from assignment import is_open
+from lifecycle import OPEN
+
+# Also the condition admin.verify_update acts on, whatever the request status, so
+# every listed update can still be verified or rejected
+PENDING_VERIFICATION = {"update_status": "pending_admin_verification"}
+_JOB_FIELDS = ("service_type", "vehicle", "status", "created_at", "updated_at", "customer_id", "mechanic_id", "update_status")
+# The update text is only carried by the pending verification lists
+_PENDING_FIELDS = (*_JOB_FIELDS, "mechanic_update")
+_NEWEST_FIRST = {"$sort": {"_id": -1}}
+MAX_RECENT = 50
+
+def check_recent(recent):
+    if recent < 1 or recent > MAX_RECENT:
+        raise HTTPException(status_code=400, detail=f"recent must be between 1 and {MAX_RECENT}")
+
+def week_start(now=None):
+    now = now or datetime.utcnow()
+    return datetime(now.year, now.month, now.day) - timedelta(days=now.weekday())
+
+def _newest(match, limit, fields):
+    return [{"$match": match}, _NEWEST_FIRST, {"$limit": limit}, {"$project": {field: 1 for field in fields}}]
+
+def _newest_per_mechanic(match, limit, fields):
+    # $topN keeps at most `limit` jobs per mechanic while grouping (MongoDB 5.2+),
+    # so memory follows mechanics x limit rather than the whole open backlog
+    output = {"_id": "$_id", **{field: f"${field}" for field in fields}}
+    return [
+        {"$match": match},
+        {"$group": {"_id": "$mechanic_id", "jobs": {"$topN": {"n": limit, "sortBy": {"_id": -1}, "output": output}}}},
+    ]
+
+def _status_counts(rows):
+    return {row["_id"]: row["count"] for row in rows}
+
+# One pass over the mechanic's service requests (mechanic_id_status__id) feeds
+# every facet; the week's parts usage comes from the ledger at the same time
+async def mechanic_dashboard(db, mechanic_id, recent=10):
+    since = week_start()
+    pipeline = [
+        {"$match": {"mechanic_id": mechanic_id}},
+        {"$project": {field: 1 for field in _PENDING_FIELDS}},
+        {"$facet": {
+            "by_status": [{"$group": {"_id": "$status", "count": {"$sum": 1}}}],
+            "open_jobs": _newest(OPEN, recent, _JOB_FIELDS),
+            "pending_verification": _newest(PENDING_VERIFICATION, recent, _PENDING_FIELDS),
+        }},
+    ]
+    facets, usage = await asyncio.gather(
+        db.service_requests.aggregate(pipeline).to_list(length=None),
+        inventory.mechanic_usage(db, since, mechanic_id),
+    )
+    facets = facets[0]
+    by_status = _status_counts(facets["by_status"])
+    return {
+        "by_status": by_status,
+        "open_total": sum(count for status, count in by_status.items() if is_open(status)),
+        "open_jobs": facets["open_jobs"],
+        "pending_verification": facets["pending_verification"],
+        "week_start": since,
+        "inventory_this_week": [
+            {"item_name": row["_id"]["item_name"], "quantity": row["quantity"], "entries": row["entries"]} for row in usage
+        ],
+    }
+
+# The same per mechanic, for the whole shop in one pass over service_requests
+async def shop_dashboard(db, recent=5):
+    since = week_start()
+    pipeline = [
+        {"$project": {field: 1 for field in _PENDING_FIELDS}},
+        {"$facet": {
+            "by_status": [{"$group": {"_id": {"mechanic_id": "$mechanic_id", "status": "$status"}, "count": {"$sum": 1}}}],
+            "open_jobs": _newest_per_mechanic(OPEN, recent, _JOB_FIELDS),
+            "pending_verification": _newest_per_mechanic(PENDING_VERIFICATION, recent, _PENDING_FIELDS),
+        }},
+    ]
+    facets, usage, mechanics = await asyncio.gather(
+        db.service_requests.aggregate(pipeline).to_list(length=None),
+        inventory.mechanic_usage(db, since),
+        db.users.find({"role": "mechanic"}, {"email": 1, "name": 1}).to_list(length=None),
+    )
+    facets = facets[0]
+
+    def entry(mechanic_id):
+        return by_mechanic.setdefault(mechanic_id, {
+            "mechanic_id": mechanic_id, "email": None, "name": None, "by_status": {}, "open_total": 0,
+            "open_jobs": [], "pending_verification": [], "inventory_this_week": [],
+        })
+
+    by_mechanic = {}
+    for mechanic in mechanics:
+        entry(str(mechanic["_id"])).update(email=mechanic.get("email"), name=mechanic.get("name"))
+    for row in facets["by_status"]:
+        mechanic = entry(row["_id"].get("mechanic_id"))
+        status = row["_id"].get("status")
+        mechanic["by_status"][status] = row["count"]
+        if is_open(status):
+            mechanic["open_total"] += row["count"]
+    for facet in ("open_jobs", "pending_verification"):
+        for row in facets[facet]:
+            entry(row["_id"])[facet] = row["jobs"]
+    for row in usage:
+        entry(row["_id"]["mechanic_id"])["inventory_this_week"].append(
+            {"item_name": row["_id"]["item_name"], "quantity": row["quantity"], "entries": row["entries"]}
+        )
+    return {"week_start": since, "mechanics": sorted(by_mechanic.values(), key=lambda m: -m["open_total"])}
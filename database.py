@@ -1,7 +1,62 @@
 from pymongo import MongoClient
+from motor.motor_asyncio import AsyncIOMotorClient
 from dotenv import load_dotenv
+from metrics import command_metrics
+import asyncio
 import os
 
 load_dotenv()
-client = MongoClient(os.getenv("MONGO_URI"))
-db = client["vehicle_service_center"]
+
+MONGO_URI = os.getenv("MONGO_URI")
+DATABASE_NAME = os.getenv("MONGO_DB_NAME", "vehicle_service_center")
+
+# Connection pool settings shared by the sync and async clients
+def client_options():
+    return {
+        "maxPoolSize": int(os.getenv("MONGO_MAX_POOL_SIZE", "100")),
+        "minPoolSize": int(os.getenv("MONGO_MIN_POOL_SIZE", "0")),
+        "maxIdleTimeMS": int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "300000")),
+        "waitQueueTimeoutMS": int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "5000")),
+        "connectTimeoutMS": int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "5000")),
+        "serverSelectionTimeoutMS": int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000")),
+        "socketTimeoutMS": int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", "30000")),
+        "readPreference": os.getenv("MONGO_READ_PREFERENCE", "primary"),
+        "event_listeners": [command_metrics],
+    }
+
+class LazyDatabase:
+    # Stands in for the database until its client is first used, so importing
+    # this module opens no connections; the API creates its client per worker
+    # process in the app lifespan instead of before uvicorn starts the workers
+    def __init__(self, client_class):
+        self._client_class = client_class
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = self._client_class(MONGO_URI, **client_options())
+        return self._client
+
+    def close(self):
+        if self._client is not None:
+            self._client.close()
+            self._client = None
+
+    def __getattr__(self, name):
+        return getattr(self.client[DATABASE_NAME], name)
+
+    def __getitem__(self, name):
+        return self.client[DATABASE_NAME][name]
+
+# Blocking client for scripts and maintenance commands
+db = LazyDatabase(MongoClient)
+
+# Non-blocking client used by the API routes
+async_db = LazyDatabase(AsyncIOMotorClient)
+
+async def warm_up(connections=None):
+    # Open the pool before the first request instead of on it
+    if connections is None:
+        connections = int(os.getenv("MONGO_WARMUP_CONNECTIONS", "0")) or max(1, client_options()["minPoolSize"])
+    await asyncio.gather(*(async_db.command("ping") for _ in range(connections)))
@@ -0,0 +1,119 @@
+import asyncio
+import logging
+import os
+from collections import defaultdict
+
+from fastapi.responses import StreamingResponse
+
+from projection import ALLOWED_FIELDS
+from serialization import dumps
+
+logger = logging.getLogger(__name__)
+
+# "local": write routes publish directly (single worker).
+# "change_stream": every worker tails service_requests instead, so events reach
+# clients connected to any worker; local publishing is then switched off.
+EVENT_SOURCE = os.getenv("EVENT_SOURCE", "local")
+EVENT_QUEUE_SIZE = int(os.getenv("EVENT_QUEUE_SIZE", "100"))
+HEARTBEAT_SECONDS = float(os.getenv("EVENT_HEARTBEAT_SECONDS", "25"))
+
+class EventBus:
+    # One bounded queue per open connection; idle connections cost a queue and a
+    # suspended coroutine. A slow client loses its oldest events, never blocks publishers.
+    def __init__(self, queue_size=EVENT_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self._subscribers = defaultdict(set)
+
+    def subscribe(self, user_id):
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self._subscribers[user_id].add(queue)
+        return queue
+
+    def unsubscribe(self, user_id, queue):
+        queues = self._subscribers.get(user_id)
+        if queues is not None:
+            queues.discard(queue)
+            if not queues:
+                del self._subscribers[user_id]
+
+    def publish(self, user_ids, event):
+        for user_id in set(user_ids):
+            for queue in self._subscribers.get(user_id, ()):
+                if queue.full():
+                    queue.get_nowait()
+                queue.put_nowait(event)
+
+    def connection_count(self):
+        return sum(len(queues) for queues in self._subscribers.values())
+
+event_bus = EventBus()
+
+def _request_event(event_type, request, changes):
+    return {
+        "type": event_type,
+        "service_request_id": request.get("_id"),
+        "changes": changes,
+    }
+
+# What each recipient may see of a change: the service request fields its role
+# may list, plus the event-only payloads addressed to it
+_EVENT_FIELDS = {"customer": ("transaction",), "mechanic": ("inventory",)}
+VISIBLE_FIELDS = {
+    role: frozenset({"_id", *(name.split(".", 1)[0] for name in ALLOWED_FIELDS[("service_requests", role)]), *extra})
+    for role, extra in _EVENT_FIELDS.items()
+}
+
+def visible_changes(role, changes):
+    # Change stream updates use dotted paths ("bill.amount"), so match on the top-level field
+    return {field: value for field, value in changes.items() if field.split(".", 1)[0] in VISIBLE_FIELDS[role]}
+
+def _publish(event_type, request, changes):
+    for role, owner in (("customer", request.get("customer_id")), ("mechanic", request.get("mechanic_id"))):
+        if not owner:
+            continue
+        visible = visible_changes(role, changes)
+        if visible:
+            event_bus.publish([owner], _request_event(event_type, request, visible))
+
+def publish_request_change(event_type, request, changes):
+    if EVENT_SOURCE == "local":
+        _publish(event_type, request, changes)
+
+def event_stream(user_id):
+    async def generate():
+        queue = event_bus.subscribe(user_id)
+        try:
+            yield b"retry: 5000\n\n"
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield b": keep-alive\n\n"
+                    continue
+                yield b"event: " + event["type"].encode() + b"\ndata: " + dumps(event) + b"\n\n"
+        finally:
+            event_bus.unsubscribe(user_id, queue)
+
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return StreamingResponse(generate(), media_type="text/event-stream", headers=headers)
+
+async def watch_service_requests(db):
+    # Resumes from the last seen change after transient errors
+    resume_token = None
+    pipeline = [{"$match": {"operationType": {"$in": ["insert", "update", "replace"]}}}]
+    while True:
+        try:
+            async with db.service_requests.watch(pipeline, full_document="updateLookup", resume_after=resume_token) as stream:
+                async for change in stream:
+                    resume_token = stream.resume_token
+                    request = change.get("fullDocument") or {"_id": change["documentKey"]["_id"]}
+                    if change["operationType"] == "update":
+                        changes = change["updateDescription"]["updatedFields"]
+                        _publish("service_request.updated", request, changes)
+                    else:
+                        _publish("service_request.created", request, request)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Service request change stream failed, reconnecting")
+            await asyncio.sleep(1)
@@ -0,0 +1,75 @@
+import csv
+from datetime import datetime, timedelta
+from typing import Optional
+
+from bson import ObjectId
+
+from pagination import build_filter, stream_documents, stream_ndjson
+
+# Columns per export, in order; dotted names reach into sub-documents
+COLUMNS = {
+    "transactions": (
+        "_id", "created_at", "service_request_id", "customer_id", "amount", "payment_method", "status",
+    ),
+    "service_requests": (
+        "_id", "created_at", "updated_at", "status", "service_type", "description",
+        "vehicle.make", "vehicle.model", "vehicle.year", "customer_id", "mechanic_id",
+        "bill.amount", "bill.description", "billed_at", "update_status",
+    ),
+}
+
+# created_at is set just before the ObjectId is generated on insert, so an _id
+# range padded by this much bounds the scan through the _id index
+_ID_SLACK = timedelta(minutes=5)
+
+def export_filter(status: Optional[str] = None, created_after: Optional[datetime] = None,
+                  created_before: Optional[datetime] = None):
+    query = build_filter({}, status, created_after, created_before)
+    if created_after or created_before:
+        id_range = {}
+        if created_after:
+            id_range["$gte"] = ObjectId.from_datetime(created_after - _ID_SLACK)
+        if created_before:
+            id_range["$lt"] = ObjectId.from_datetime(created_before + _ID_SLACK)
+        query["_id"] = id_range
+    return query
+
+def _value(doc, column):
+    value = doc
+    for part in column.split("."):
+        if not isinstance(value, dict):
+            return ""
+        value = value.get(part)
+    if value is None:
+        return ""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, str) and value[:1] in ("=", "+", "-", "@"):
+        # Keep spreadsheets from evaluating client-supplied text as a formula
+        return "'" + value
+    return value
+
+class _LineBuffer:
+    def write(self, line):
+        self.line = line
+
+def stream_export(collection, name: str, file_format: str, query: dict, archive=None):
+    columns = COLUMNS[name]
+    filename = f"{name}-{datetime.utcnow():%Y%m%d}.{file_format}"
+    headers = {"Content-Disposition": f'attachment; filename="{filename}"'}
+    projection = {column.split(".", 1)[0]: 1 for column in columns}
+    if file_format == "ndjson":
+        return stream_ndjson(collection, query, projection=projection, headers=headers, archive=archive)
+
+    buffer = _LineBuffer()
+    writer = csv.writer(buffer)
+
+    def encode(doc):
+        writer.writerow([_value(doc, column) for column in columns])
+        return buffer.line.encode()
+
+    writer.writerow(columns)
+    return stream_documents(
+        collection, query, encode, "text/csv",
+        projection=projection, headers=headers, archive=archive, preamble=buffer.line.encode(),
+    )
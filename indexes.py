@@ -0,0 +1,195 @@
+import argparse
+import asyncio
+import logging
+import sys
+
+from datetime import datetime
+
+from bson import ObjectId, SON
+from pymongo import ASCENDING, DESCENDING, TEXT, IndexModel
+from pymongo.errors import OperationFailure
+
+from assignment import CLOSED_STATUSES
+
+logger = logging.getLogger(__name__)
+
+# Declarative index registry: collection name -> indexes the routes rely on.
+# create_indexes is a no-op for indexes that already exist, so this is safe to apply on every startup.
+INDEXES = {
+    "users": [
+        IndexModel([("email", ASCENDING)], name="email_unique", unique=True),
+        IndexModel([("role", ASCENDING)], name="role"),
+    ],
+    "service_requests": [
+        IndexModel([("customer_id", ASCENDING), ("_id", DESCENDING)], name="customer_id__id"),
+        IndexModel([("mechanic_id", ASCENDING), ("status", ASCENDING), ("_id", DESCENDING)], name="mechanic_id_status__id"),
+        IndexModel([("status", ASCENDING), ("_id", DESCENDING)], name="status__id"),
+        # admin.search_service_requests: free text, ranked, and structured vehicle filters
+        IndexModel(
+            [("service_type", TEXT), ("description", TEXT), ("vehicle.make", TEXT), ("vehicle.model", TEXT)],
+            name="search_text",
+            weights={"service_type": 5, "vehicle.make": 3, "vehicle.model": 3, "description": 1},
+            default_language="english",
+        ),
+        # Structured search always filters on make; each index ends in _id so the
+        # newest-first page is read in index order. year and status narrow the
+        # scan as filters when only a shorter prefix applies.
+        IndexModel([("vehicle.make", ASCENDING), ("_id", DESCENDING)], name="vehicle_make__id"),
+        IndexModel([("vehicle.make", ASCENDING), ("vehicle.model", ASCENDING), ("_id", DESCENDING)], name="vehicle_make_model__id"),
+        IndexModel([("vehicle.make", ASCENDING), ("vehicle.model", ASCENDING), ("vehicle.year", ASCENDING), ("_id", DESCENDING)], name="vehicle__id"),
+    ],
+    "transactions": [
+        IndexModel([("service_request_id", ASCENDING), ("status", ASCENDING)], name="service_request_id_status"),
+        # At most one completed payment per request; makes initiate_payment idempotent
+        IndexModel([("service_request_id", ASCENDING)], name="service_request_id_paid_unique", unique=True,
+                   partialFilterExpression={"status": "completed"}),
+        IndexModel([("customer_id", ASCENDING), ("status", ASCENDING)], name="customer_id_status"),
+        IndexModel([("status", ASCENDING), ("_id", DESCENDING)], name="status__id"),
+    ],
+    # Archive tiers serve the merged completed_requests / completed_transactions reads
+    "service_requests_archive": [
+        IndexModel([("mechanic_id", ASCENDING), ("status", ASCENDING), ("_id", DESCENDING)], name="mechanic_id_status__id"),
+        IndexModel([("status", ASCENDING), ("_id", DESCENDING)], name="status__id"),
+    ],
+    "transactions_archive": [
+        IndexModel([("customer_id", ASCENDING), ("status", ASCENDING)], name="customer_id_status"),
+        IndexModel([("status", ASCENDING), ("_id", DESCENDING)], name="status__id"),
+    ],
+    "rollups_daily": [
+        IndexModel([("_id.day", ASCENDING)], name="day"),
+    ],
+    "inventory": [
+        IndexModel([("item_name", ASCENDING), ("recorded_at", DESCENDING)], name="item_name_recorded_at"),
+        IndexModel([("service_request_id", ASCENDING), ("recorded_at", ASCENDING)], name="service_request_id_recorded_at"),
+        IndexModel([("mechanic_id", ASCENDING), ("recorded_at", DESCENDING)], name="mechanic_id_recorded_at"),
+    ],
+    "inventory_usage_daily": [
+        IndexModel([("_id.day", ASCENDING), ("_id.item_name", ASCENDING)], name="day_item_name"),
+    ],
+    # Login throttling buckets (RATE_LIMIT_BACKEND=mongo) are dropped once they would be full again
+    "rate_limits": [
+        IndexModel([("expires_at", ASCENDING)], name="expires_at_ttl", expireAfterSeconds=0),
+    ],
+}
+
+# Unique indexes the routes rely on for correctness, not just speed: register and
+# initiate_payment reject duplicate emails and second payments through them, so a
+# worker must not serve traffic without them
+REQUIRED_INDEXES = {
+    "users": ["email_unique"],
+    "transactions": ["service_request_id_paid_unique"],
+}
+
+_SAMPLE_ID = str(ObjectId())
+_NEWEST_FIRST = [("_id", DESCENDING)]
+
+# Query shapes issued by the routes: (route, collection, filter, sort)
+QUERY_SHAPES = [
+    ("auth.get_current_user", "users", {"email": "user@example.com"}, None),
+    ("customer.login_customer", "users", {"email": "user@example.com", "role": "customer"}, None),
+    # schedule_service assigns from memory; the assigner reads once per worker at startup
+    ("assignment.assigner.rebuild", "users", {"role": "mechanic"}, None),
+    ("assignment.assigner.rebuild (open requests)", "service_requests", {"status": {"$nin": list(CLOSED_STATUSES)}}, None),
+    ("customer.get_customer_requests", "service_requests", {"customer_id": _SAMPLE_ID}, None),
+    ("customer.get_customer_requests ($lookup)", "transactions", {"service_request_id": _SAMPLE_ID, "status": "completed"}, None),
+    ("customer.initiate_payment", "service_requests", {"_id": ObjectId(), "customer_id": _SAMPLE_ID}, None),
+    ("customer.get_completed_transactions", "transactions", {"customer_id": _SAMPLE_ID, "status": "completed"}, None),
+    ("mechanic.get_assigned_requests", "service_requests", {"mechanic_id": _SAMPLE_ID}, None),
+    ("mechanic.get_completed_requests", "service_requests", {"mechanic_id": _SAMPLE_ID, "status": "completed"}, _NEWEST_FIRST),
+    ("admin.get_service_requests", "service_requests", {}, _NEWEST_FIRST),
+    ("admin.get_service_requests?status", "service_requests", {"status": "pending"}, _NEWEST_FIRST),
+    ("admin.get_completed_requests", "service_requests", {"status": "completed"}, _NEWEST_FIRST),
+    ("admin.get_all_completed_transactions", "transactions", {"status": "completed"}, _NEWEST_FIRST),
+    ("admin.search_service_requests?q", "service_requests", {"$text": {"$search": "brake pads"}}, None),
+    ("admin.search_service_requests?q&make&model", "service_requests", {"$text": {"$search": "brake pads"}, "vehicle.make": "Toyota", "vehicle.model": "Corolla"}, None),
+    ("admin.search_service_requests?q&model", "service_requests", {"$text": {"$search": "brake pads"}, "vehicle.model": "Corolla"}, None),
+    ("admin.search_service_requests?make", "service_requests", {"vehicle.make": "Toyota"}, _NEWEST_FIRST),
+    ("admin.search_service_requests?make&status", "service_requests", {"vehicle.make": "Toyota", "status": "pending"}, _NEWEST_FIRST),
+    ("admin.search_service_requests?make&year", "service_requests", {"vehicle.make": "Toyota", "vehicle.year": 2015}, _NEWEST_FIRST),
+    ("admin.search_service_requests?make&model", "service_requests", {"vehicle.make": "Toyota", "vehicle.model": "Corolla"}, _NEWEST_FIRST),
+    ("admin.search_service_requests?make&model&status", "service_requests", {"vehicle.make": "Toyota", "vehicle.model": "Corolla", "status": "pending"}, _NEWEST_FIRST),
+    ("admin.search_service_requests?make&model&year", "service_requests", {"vehicle.make": "Toyota", "vehicle.model": "Corolla", "vehicle.year": 2015}, _NEWEST_FIRST),
+    ("admin.search_service_requests?make&model&year&status", "service_requests", {"vehicle.make": "Toyota", "vehicle.model": "Corolla", "vehicle.year": 2015, "status": "pending"}, _NEWEST_FIRST),
+    ("admin.get_revenue_dashboard", "rollups_daily", {"_id.day": {"$gte": "2024-01-01", "$lte": "2024-01-31"}}, None),
+    ("archive.archive_batch", "transactions", {"status": "completed", "_id": {"$lt": ObjectId()}, "created_at": {"$lt": datetime(2024, 1, 1)}}, [("_id", ASCENDING)]),
+    ("admin.get_inventory_usage", "inventory_usage_daily", {"_id.day": {"$gte": "2024-01-01", "$lte": "2024-01-31"}}, None),
+    ("admin.get_request_inventory_usage", "inventory", {"service_request_id": _SAMPLE_ID}, [("recorded_at", ASCENDING)]),
+    ("mechanic.get_dashboard", "service_requests", {"mechanic_id": _SAMPLE_ID}, None),
+    ("mechanic.get_dashboard (inventory)", "inventory", {"mechanic_id": _SAMPLE_ID, "recorded_at": {"$gte": datetime(2024, 1, 1)}}, None),
+    ("admin.get_mechanics_dashboard (inventory)", "inventory", {"recorded_at": {"$gte": datetime(2024, 1, 1)}, "_id": {"$gte": ObjectId.from_datetime(datetime(2024, 1, 1))}}, None),
+]
+
+def _missing(collection, existing):
+    return [f"{collection}.{name}" for name in REQUIRED_INDEXES[collection] if name not in existing]
+
+# Both return the required indexes that still do not exist, e.g. a unique index
+# that cannot be built because the collection already holds duplicates
+def ensure_indexes(db):
+    for collection, indexes in INDEXES.items():
+        try:
+            db[collection].create_indexes(indexes)
+        except OperationFailure as e:
+            # A conflicting or unbuildable index (e.g. duplicate emails) needs manual cleanup
+            logger.error("Could not create indexes on %s: %s", collection, e)
+    missing = []
+    for collection in REQUIRED_INDEXES:
+        missing.extend(_missing(collection, db[collection].index_information()))
+    return missing
+
+async def ensure_indexes_async(db):
+    async def create(collection, indexes):
+        try:
+            await db[collection].create_indexes(indexes)
+        except OperationFailure as e:
+            logger.error("Could not create indexes on %s: %s", collection, e)
+
+    await asyncio.gather(*(create(collection, indexes) for collection, indexes in INDEXES.items()))
+    existing = await asyncio.gather(*(db[collection].index_information() for collection in REQUIRED_INDEXES))
+    return [name for collection, names in zip(REQUIRED_INDEXES, existing) for name in _missing(collection, names)]
+
+def _plan_stages(plan):
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            yield plan["stage"]
+        for value in plan.values():
+            yield from _plan_stages(value)
+    elif isinstance(plan, list):
+        for item in plan:
+            yield from _plan_stages(item)
+
+def explain_query_shapes(db):
+    results = []
+    for route, collection, query, sort in QUERY_SHAPES:
+        command = SON([("find", collection), ("filter", query)])
+        if sort:
+            command["sort"] = SON(sort)
+        explain = db.command("explain", command, verbosity="queryPlanner")
+        stages = list(_plan_stages(explain["queryPlanner"]["winningPlan"]))
+        results.append({
+            "route": route, "collection": collection, "stages": stages,
+            "collscan": "COLLSCAN" in stages,
+            # An in-memory sort reads every matching document before returning the first page
+            "blocking_sort": sort is not None and "SORT" in stages,
+        })
+    return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Apply the index registry and check route query plans")
+    parser.add_argument("--apply", action="store_true", help="create missing indexes before checking")
+    args = parser.parse_args(argv)
+
+    from database import db
+    failed = False
+    if args.apply:
+        for name in ensure_indexes(db):
+            print(f"MISSING  {name} (required unique index; remove the duplicates and re-run)")
+            failed = True
+
+    for result in explain_query_shapes(db):
+        flag = "COLLSCAN" if result["collscan"] else "SORT" if result["blocking_sort"] else "ok"
+        print(f"{flag:8} {result['route']} ({result['collection']}): {' > '.join(result['stages'])}")
+        failed = failed or result["collscan"] or result["blocking_sort"]
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,184 @@
+import argparse
+import asyncio
+import logging
+import sys
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+from fastapi import HTTPException
+from pymongo import ASCENDING, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError
+
+from bulk import write_errors_by_index
+from indexes import INDEXES
+
+logger = logging.getLogger(__name__)
+
+# inventory_stock:       _id item_name -> quantity (on hand), used_total, restocked_total
+# inventory:             append-only usage ledger, one row per recorded use
+# inventory_usage_daily: _id {day, item_name} -> quantity, entries
+STOCK = "inventory_stock"
+LEDGER = "inventory"
+USAGE_DAILY = "inventory_usage_daily"
+
+INSUFFICIENT_STOCK = "Insufficient stock"
+UNKNOWN_ITEM = "Unknown inventory item"
+
+def _day(moment):
+    return moment.strftime("%Y-%m-%d")
+
+async def restock(db, item_name, quantity):
+    return await db[STOCK].find_one_and_update(
+        {"_id": item_name},
+        {"$inc": {"quantity": quantity, "restocked_total": quantity}, "$set": {"updated_at": datetime.utcnow()}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+
+async def _take(db, item_name, quantity):
+    # Decrement only if enough is on hand, so stock never goes negative
+    taken = await db[STOCK].find_one_and_update(
+        {"_id": item_name, "quantity": {"$gte": quantity}},
+        {"$inc": {"quantity": -quantity, "used_total": quantity}, "$set": {"updated_at": datetime.utcnow()}},
+        projection={"_id": 1},
+    )
+    if taken is not None:
+        return None
+    if await db[STOCK].count_documents({"_id": item_name}, limit=1):
+        return INSUFFICIENT_STOCK
+    return UNKNOWN_ITEM
+
+async def record_usage(db, records):
+    # records: dicts with item_name, quantity_used, service_request_id and mechanic_id.
+    # Stock is taken once per item, so all records for one item in a batch
+    # succeed or fail together. Returns, per record, its ledger row (or None) and its error (or None).
+    wanted = defaultdict(int)
+    for record in records:
+        wanted[record["item_name"]] += record["quantity_used"]
+    items = list(wanted)
+    item_errors = dict(zip(items, await asyncio.gather(*(_take(db, item, wanted[item]) for item in items))))
+
+    recorded_at = datetime.utcnow()
+    errors = [item_errors[record["item_name"]] for record in records]
+    rows, row_records = [], []
+    for index, record in enumerate(records):
+        if errors[index] is None:
+            rows.append({**record, "recorded_at": recorded_at})
+            row_records.append(index)
+
+    failed = {}
+    if rows:
+        try:
+            await db[LEDGER].insert_many(rows, ordered=False)
+        except BulkWriteError as e:
+            failed = write_errors_by_index(e)
+
+    recorded = [None] * len(records)
+    used = defaultdict(lambda: [0, 0])
+    refunds = defaultdict(int)
+    for row_index, index in enumerate(row_records):
+        row = rows[row_index]
+        if row_index in failed:
+            errors[index] = failed[row_index]
+            refunds[row["item_name"]] += row["quantity_used"]
+        else:
+            recorded[index] = row
+            used[row["item_name"]][0] += row["quantity_used"]
+            used[row["item_name"]][1] += 1
+
+    if used:
+        await db[USAGE_DAILY].bulk_write([
+            UpdateOne({"_id": {"day": _day(recorded_at), "item_name": item}}, {"$inc": {"quantity": quantity, "entries": entries}}, upsert=True)
+            for item, (quantity, entries) in used.items()
+        ], ordered=False)
+    if refunds:
+        # Put back stock taken for rows the ledger rejected
+        await db[STOCK].bulk_write([
+            UpdateOne({"_id": item}, {"$inc": {"quantity": quantity, "used_total": -quantity}})
+            for item, quantity in refunds.items()
+        ], ordered=False)
+    return recorded, errors
+
+async def record_one(db, record):
+    recorded, errors = await record_usage(db, [record])
+    if errors[0] == UNKNOWN_ITEM:
+        raise HTTPException(status_code=404, detail=UNKNOWN_ITEM)
+    if errors[0] is not None:
+        raise HTTPException(status_code=409, detail=errors[0])
+    return recorded[0]
+
+async def stock_levels(db, item_name=None):
+    query = {"_id": item_name} if item_name else {}
+    return await db[STOCK].find(query).sort("_id", ASCENDING).to_list(length=None)
+
+async def usage_summary(db, start, end, item_name=None):
+    match = {"_id.day": {"$gte": start, "$lte": end}}
+    if item_name:
+        match["_id.item_name"] = item_name
+    pipeline = [
+        {"$match": match},
+        {"$group": {"_id": "$_id.item_name", "quantity": {"$sum": "$quantity"}, "entries": {"$sum": "$entries"}}},
+        {"$sort": {"_id": 1}},
+    ]
+    return await db[USAGE_DAILY].aggregate(pipeline).to_list(length=None)
+
+async def mechanic_usage(db, since, mechanic_id=None):
+    match = {"recorded_at": {"$gte": since}}
+    if mechanic_id is not None:
+        match["mechanic_id"] = mechanic_id
+    else:
+        # Ledger rows get their _id right after recorded_at is set, so an _id
+        # bound lets the whole-shop query range-scan the _id index
+        match["_id"] = {"$gte": ObjectId.from_datetime(since - timedelta(minutes=5))}
+    pipeline = [
+        {"$match": match},
+        {"$group": {
+            "_id": {"mechanic_id": "$mechanic_id", "item_name": "$item_name"},
+            "quantity": {"$sum": "$quantity_used"},
+            "entries": {"$sum": 1},
+        }},
+        {"$sort": {"_id.mechanic_id": 1, "_id.item_name": 1}},
+    ]
+    return await db[LEDGER].aggregate(pipeline).to_list(length=None)
+
+async def request_usage(db, service_request_id):
+    return await db[LEDGER].find({"service_request_id": service_request_id}).sort("recorded_at", ASCENDING).to_list(length=None)
+
+def rebuild(db):
+    # Recompute the daily usage counters from the ledger, e.g. to backfill rows
+    # recorded before the counters existed. Run it during a quiet period.
+    rows = list(db[LEDGER].aggregate([
+        {"$match": {"item_name": {"$type": "string"}, "quantity_used": {"$type": "number"}}},
+        {"$group": {
+            "_id": {
+                "day": {"$dateToString": {"format": "%Y-%m-%d", "date": {"$ifNull": ["$recorded_at", {"$toDate": "$_id"}]}}},
+                "item_name": "$item_name",
+            },
+            "quantity": {"$sum": "$quantity_used"},
+            "entries": {"$sum": 1},
+        }},
+    ]))
+    staging = db[USAGE_DAILY + "_rebuild"]
+    staging.drop()
+    if rows:
+        staging.insert_many(rows)
+        staging.create_indexes(INDEXES[USAGE_DAILY])
+        staging.rename(USAGE_DAILY, dropTarget=True)
+    else:
+        db[USAGE_DAILY].drop()
+    logger.info("Rebuilt %s with %d rows", USAGE_DAILY, len(rows))
+    return {USAGE_DAILY: len(rows)}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Maintain the inventory usage counters")
+    parser.add_argument("command", choices=["rebuild"])
+    parser.parse_args(argv)
+
+    from database import db
+    for name, count in rebuild(db).items():
+        print(f"{name}: {count} rows")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
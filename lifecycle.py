@@ -0,0 +1,66 @@
+import asyncio
+
+from fastapi import HTTPException
+
+import rollups
+import versions
+from assignment import CLOSED_STATUSES, assigner
+from database import async_db as db
+from events import publish_request_change
+
+# Side effects of service request writes, shared by every router so the
+# mechanic assigner, the dashboard rollups, the list ETags and the event stream see the same events.
+# Documents passed in must carry at least the REQUEST_FIELDS below.
+# The rollup and version writes are independent, so each hook sends them
+# concurrently and adds one round trip after the route's own write.
+REQUEST_FIELDS = {"status": 1, "customer_id": 1, "mechanic_id": 1, "service_type": 1}
+OPEN = {"status": {"$nin": list(CLOSED_STATUSES)}}
+
+async def raise_transition_error(request_query, not_found, conflict):
+    # Only reached once a guarded find_one_and_update matched nothing: tell a
+    # missing request apart from one in a state that forbids the transition
+    if await db.service_requests.count_documents(request_query, limit=1):
+        raise HTTPException(status_code=409, detail=conflict)
+    raise HTTPException(status_code=404, detail=not_found)
+
+async def request_created(request):
+    await asyncio.gather(
+        rollups.apply(db, rollups.created_operations(request)),
+        versions.bump(db, versions.document_scopes("service_requests", request)),
+    )
+    publish_request_change("service_request.created", request, request)
+
+async def status_changed(previous, new_status, changes=None):
+    await statuses_changed([(previous, new_status, changes)])
+
+async def statuses_changed(changes):
+    operations = []
+    scopes = []
+    for previous, new_status, fields in changes:
+        assigner.on_status_change(previous.get("mechanic_id"), previous.get("status"), new_status)
+        operations.extend(rollups.status_change_operations(previous, new_status))
+        scopes.extend(versions.document_scopes("service_requests", previous))
+        publish_request_change("service_request.updated", previous, fields or {"status": new_status})
+    await asyncio.gather(rollups.apply(db, operations), versions.bump(db, scopes))
+
+async def request_updated(request, changes):
+    await versions.bump(db, versions.document_scopes("service_requests", request))
+    publish_request_change("service_request.updated", request, changes)
+
+async def inventory_recorded(request, usage):
+    publish_request_change("service_request.updated", request, {"inventory": usage})
+
+async def bill_generated(request, bill):
+    await asyncio.gather(
+        rollups.apply(db, rollups.bill_operations(request, bill["amount"])),
+        versions.bump(db, versions.document_scopes("service_requests", request)),
+    )
+    publish_request_change("service_request.updated", request, {"bill": bill})
+
+async def payment_completed(request, transaction):
+    # Paid requests drop out of the customer's open list, so both scopes change
+    await asyncio.gather(
+        rollups.apply(db, rollups.payment_operations(request, transaction["amount"])),
+        versions.bump(db, versions.document_scopes("service_requests", request) + versions.document_scopes("transactions", transaction)),
+    )
+    publish_request_change("service_request.paid", request, {"transaction": transaction})
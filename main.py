@@ -1,9 +1,92 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
+from fastapi.responses import JSONResponse, PlainTextResponse
 from routes.customer import router as customer_router
 from routes import mechanic, admin
 from fastapi.middleware.cors import CORSMiddleware
+from database import db, async_db, warm_up
+from indexes import ensure_indexes_async
+from auth import PASSWORD_HASH_WORKERS, shutdown_password_executor
+from assignment import assigner
+from metrics import MetricsMiddleware, record_startup, render_metrics
+import archive
+import asyncio
+import events
+import ratelimit
+import logging
+import os
+import time
 
-app = FastAPI()
+logger = logging.getLogger(__name__)
+
+READINESS_TIMEOUT_SECONDS = float(os.getenv("READINESS_TIMEOUT_SECONDS", "2"))
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
+
+def _check_worker_settings():
+    if WEB_CONCURRENCY <= 1:
+        return
+    # Per-process state that only holds for a single worker
+    if events.EVENT_SOURCE == "local":
+        logger.warning("WEB_CONCURRENCY=%d with EVENT_SOURCE=local: event streams miss writes handled by other workers; "
+                       "set EVENT_SOURCE=change_stream", WEB_CONCURRENCY)
+    if ratelimit.RATE_LIMIT_BACKEND == "memory":
+        logger.warning("WEB_CONCURRENCY=%d with RATE_LIMIT_BACKEND=memory: each worker throttles logins separately; "
+                       "set RATE_LIMIT_BACKEND=mongo", WEB_CONCURRENCY)
+    if archive.ARCHIVE_INTERVAL_SECONDS > 0:
+        logger.warning("WEB_CONCURRENCY=%d with ARCHIVE_INTERVAL_SECONDS set: every worker runs the archival job; "
+                       "set ARCHIVE_INTERVAL_SECONDS=0 and schedule `python archive.py run` once instead", WEB_CONCURRENCY)
+    logger.warning("WEB_CONCURRENCY=%d: up to %d bcrypt processes in total (PASSWORD_HASH_WORKERS per worker); "
+                   "the mechanic assigner balances load per worker only", WEB_CONCURRENCY, WEB_CONCURRENCY * PASSWORD_HASH_WORKERS)
+
+async def _stop(task):
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+
+# Runs once per worker process: the Mongo client, its warm connections and the
+# in-memory state all belong to the worker that serves the requests
+@asynccontextmanager
+async def lifespan(app):
+    app.state.ready = False
+    _check_worker_settings()
+    started = time.perf_counter()
+    await warm_up()
+    connected = time.perf_counter()
+    missing = await ensure_indexes_async(async_db)
+    if missing:
+        # Registration and payments would accept duplicates without them
+        raise RuntimeError(f"Required unique indexes are missing: {', '.join(missing)}; "
+                           "remove the duplicate documents and restart")
+    indexed = time.perf_counter()
+    await assigner.rebuild(async_db)
+
+    background = []
+    if events.EVENT_SOURCE == "change_stream":
+        background.append(asyncio.create_task(events.watch_service_requests(async_db)))
+    if archive.ARCHIVE_INTERVAL_SECONDS > 0:
+        background.append(asyncio.create_task(archive.run_periodically(async_db)))
+
+    app.state.startup_seconds = time.perf_counter() - started
+    record_startup(app.state.startup_seconds)
+    logger.info(
+        "Worker %d ready in %.0fms (connect %.0fms, indexes %.0fms, workload %.0fms)",
+        os.getpid(), app.state.startup_seconds * 1000, (connected - started) * 1000,
+        (indexed - connected) * 1000, (time.perf_counter() - indexed) * 1000,
+    )
+    app.state.ready = True
+    try:
+        yield
+    finally:
+        app.state.ready = False
+        for task in background:
+            await _stop(task)
+        shutdown_password_executor()
+        async_db.close()
+        db.close()
+
+app = FastAPI(lifespan=lifespan)
 
 # Register the customer router
 app.include_router(customer_router)
@@ -16,7 +99,28 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(MetricsMiddleware)
 
 @app.get("/")
 def home():
     return {"message": "Vehicle Service Center API is live"}
+
+# Liveness: the worker's event loop is serving requests
+@app.get("/healthz", include_in_schema=False)
+async def healthz():
+    return {"status": "ok"}
+
+# Readiness: startup finished and Mongo answers within the timeout
+@app.get("/readyz", include_in_schema=False)
+async def readyz():
+    if not getattr(app.state, "ready", False):
+        return JSONResponse({"status": "starting"}, status_code=503)
+    try:
+        await asyncio.wait_for(async_db.command("ping"), READINESS_TIMEOUT_SECONDS)
+    except Exception:
+        return JSONResponse({"status": "database unavailable"}, status_code=503)
+    return {"status": "ready", "startup_seconds": round(app.state.startup_seconds, 3)}
+
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,206 @@
+import contextvars
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+
+from pymongo import monitoring
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "0"))  # 0 disables the slow-request log
+
+class Histogram:
+    def __init__(self, name, help_text, label_names, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * len(self.buckets), 0.0, 0]
+            index = bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            snapshot = [(labels, list(counts), total, count) for labels, (counts, total, count) in sorted(self._series.items())]
+        for labels, counts, total, count in snapshot:
+            base = _labels(self.label_names, labels)
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f'{self.name}_bucket{{{base},le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_bucket{{{base},le="+Inf"}} {count}')
+            lines.append(f"{self.name}_sum{{{base}}} {total}")
+            lines.append(f"{self.name}_count{{{base}}} {count}")
+        return lines
+
+class Counter:
+    def __init__(self, name, help_text, label_names):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            snapshot = sorted(self._values.items())
+        for labels, value in snapshot:
+            lines.append(f"{self.name}{{{_labels(self.label_names, labels)}}} {value}")
+        return lines
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _labels(names, values):
+    return ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+
+request_latency = Histogram("http_request_duration_seconds", "HTTP request latency by route", ("method", "route"))
+request_count = Counter("http_requests_total", "HTTP requests by route and status code", ("method", "route", "status"))
+command_latency = Histogram("mongo_command_duration_seconds", "Mongo command latency by collection, command and issuing route", ("collection", "command", "route"))
+command_failures = Counter("mongo_command_failures_total", "Failed Mongo commands by collection, command and issuing route", ("collection", "command", "route"))
+
+# Per-request state, visible to the command listener because Motor copies the
+# context into the executor thread that runs each command
+class RequestContext:
+    def __init__(self, scope):
+        self.scope = scope
+        self.commands = []
+
+    @property
+    def route(self):
+        route = self.scope.get("route")
+        return getattr(route, "path", None) or "unmatched"
+
+_current_request = contextvars.ContextVar("current_request", default=None)
+
+class CommandMetrics(monitoring.CommandListener):
+    def __init__(self):
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def started(self, event):
+        command = event.command
+        if event.command_name == "getMore":
+            collection = command.get("collection")
+        else:
+            collection = command.get(event.command_name)
+        if not isinstance(collection, str):
+            collection = ""
+        with self._lock:
+            self._pending[(event.connection_id, event.request_id)] = (collection, _current_request.get())
+
+    def succeeded(self, event):
+        self._finish(event, failed=False)
+
+    def failed(self, event):
+        self._finish(event, failed=True)
+
+    def _finish(self, event, failed):
+        with self._lock:
+            collection, request = self._pending.pop((event.connection_id, event.request_id), ("", None))
+        route = request.route if request is not None else "background"
+        seconds = event.duration_micros / 1_000_000
+        labels = (collection, event.command_name, route)
+        command_latency.observe(labels, seconds)
+        if failed:
+            command_failures.inc(labels)
+        if request is not None:
+            request.commands.append((event.command_name, collection, seconds, failed))
+
+command_metrics = CommandMetrics()
+
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        request = RequestContext(scope)
+        token = _current_request.set(request)
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            _current_request.reset(token)
+            route = request.route
+            request_latency.observe((scope["method"], route), elapsed)
+            request_count.inc((scope["method"], route, status_code))
+            if SLOW_REQUEST_MS and elapsed * 1000 >= SLOW_REQUEST_MS:
+                _log_slow_request(scope, route, status_code, elapsed, request.commands)
+
+def _log_slow_request(scope, route, status_code, elapsed, commands):
+    breakdown = "; ".join(
+        f"{name} {collection} {seconds * 1000:.1f}ms{' FAILED' if failed else ''}"
+        for name, collection, seconds, failed in commands
+    )
+    mongo_ms = sum(seconds for _, _, seconds, _ in commands) * 1000
+    logger.warning(
+        "Slow request %s %s (%s) -> %s in %.1fms, %d Mongo commands totalling %.1fms: %s",
+        scope["method"], scope["path"], route, status_code, elapsed * 1000, len(commands), mongo_ms, breakdown,
+    )
+
+_startup_seconds = None
+
+def record_startup(seconds):
+    global _startup_seconds
+    _startup_seconds = seconds
+
+def render_metrics():
+    from auth import user_cache
+    import ratelimit
+    lines = []
+    for metric in (request_latency, request_count, command_latency, command_failures):
+        lines.extend(metric.render())
+    if _startup_seconds is not None:
+        lines += [
+            "# HELP app_startup_seconds Time this worker took to connect, warm up and load its state",
+            "# TYPE app_startup_seconds gauge",
+            f"app_startup_seconds {_startup_seconds}",
+        ]
+    stats = user_cache.stats()
+    lines += [
+        "# HELP auth_user_cache_hits_total Authenticated-user cache hits",
+        "# TYPE auth_user_cache_hits_total counter",
+        f"auth_user_cache_hits_total {stats['hits']}",
+        "# HELP auth_user_cache_misses_total Authenticated-user cache misses",
+        "# TYPE auth_user_cache_misses_total counter",
+        f"auth_user_cache_misses_total {stats['misses']}",
+        "# HELP auth_user_cache_size Entries in the authenticated-user cache",
+        "# TYPE auth_user_cache_size gauge",
+        f"auth_user_cache_size {stats['size']}",
+        "# HELP auth_rate_limited_total Login and register attempts rejected with 429, by bucket",
+        "# TYPE auth_rate_limited_total counter",
+    ]
+    for name, value in sorted(ratelimit.stats()["limited"].items()):
+        lines.append(f'auth_rate_limited_total{{limit="{name}"}} {value}')
+    return "\n".join(lines) + "\n"
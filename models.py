@@ -1,6 +1,6 @@
 # backend/models.py
 
-from pydantic import BaseModel, EmailStr
+from pydantic import BaseModel, EmailStr, conint
 from typing import Optional
 
 class UserBase(BaseModel):
@@ -24,3 +24,7 @@ class ServiceRequestModel(BaseModel):
     service_type: str
     description: str
     vehicle: VehicleModel
+
+class InventoryUsageModel(BaseModel):
+    item_name: str
+    quantity_used: conint(gt=0)
@@ -0,0 +1,181 @@
+import asyncio
+import base64
+import json
+from datetime import datetime
+from typing import Optional
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+
+from serialization import dumps
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+STREAM_BATCH_SIZE = 500
+STREAM_CHUNK_BYTES = 64 * 1024
+MAX_RANKED_OFFSET = 10000
+
+# Cursors are opaque to clients: base64 of the last _id seen on the page.
+# ObjectIds are monotonic with insertion time, so ordering by _id follows created_at.
+def encode_cursor(last_id):
+    raw = json.dumps({"i": str(last_id)}).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor: str):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return ObjectId(data["i"])
+    except (ValueError, KeyError, TypeError, InvalidId):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+# Relevance-ranked results have no stable key to resume from, so their cursors carry an offset
+def encode_offset_cursor(offset):
+    raw = json.dumps({"o": offset}).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_offset_cursor(cursor: str):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        offset = json.loads(base64.urlsafe_b64decode(padded.encode()))["o"]
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not isinstance(offset, int) or offset < 0 or offset > MAX_RANKED_OFFSET:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return offset
+
+def build_filter(base: dict, status: Optional[str] = None,
+                 created_after: Optional[datetime] = None,
+                 created_before: Optional[datetime] = None):
+    query = dict(base)
+    if status:
+        query["status"] = status
+    if created_after or created_before:
+        created = {}
+        if created_after:
+            created["$gte"] = created_after
+        if created_before:
+            created["$lt"] = created_before
+        query["created_at"] = created
+    return query
+
+def page_size(limit: Optional[int]):
+    if limit is None:
+        return DEFAULT_PAGE_SIZE
+    if limit < 1 or limit > MAX_PAGE_SIZE:
+        raise HTTPException(status_code=400, detail=f"limit must be between 1 and {MAX_PAGE_SIZE}")
+    return limit
+
+def merge_newest_first(hot, archived):
+    # Documents briefly present in both tiers while being archived are returned once
+    seen = {doc["_id"] for doc in hot}
+    return sorted(hot + [doc for doc in archived if doc["_id"] not in seen], key=lambda doc: doc["_id"], reverse=True)
+
+async def fetch_all(collection, query: dict, projection: Optional[dict] = None, archive=None):
+    if archive is None:
+        return await collection.find(query, projection).to_list(length=None)
+    hot, archived = await asyncio.gather(
+        collection.find(query, projection).to_list(length=None),
+        archive.find(query, projection).to_list(length=None),
+    )
+    return merge_newest_first(hot, archived)
+
+async def fetch_page(collection, query: dict, limit: Optional[int] = None, cursor: Optional[str] = None,
+                     projection: Optional[dict] = None, archive=None):
+    limit = page_size(limit)
+    if cursor:
+        query = {**query, "_id": {"$lt": decode_cursor(cursor)}}
+    # Fetch one extra document to know whether another page exists
+    tiers = [collection] if archive is None else [collection, archive]
+    pages = await asyncio.gather(*(
+        tier.find(query, projection).sort("_id", -1).limit(limit + 1).to_list(length=limit + 1) for tier in tiers
+    ))
+    docs = pages[0] if archive is None else merge_newest_first(*pages)[:limit + 1]
+    next_cursor = None
+    if len(docs) > limit:
+        docs = docs[:limit]
+        next_cursor = encode_cursor(docs[-1]["_id"])
+    return docs, next_cursor
+
+async def fetch_ranked_page(collection, query: dict, limit: Optional[int] = None, cursor: Optional[str] = None,
+                            projection: Optional[dict] = None):
+    # query must contain a $text clause; results come best match first
+    limit = page_size(limit)
+    offset = decode_offset_cursor(cursor) if cursor else 0
+    score = {"$meta": "textScore"}
+    docs = await (
+        collection.find(query, {**(projection or {}), "score": score})
+        .sort([("score", score), ("_id", -1)])
+        .skip(offset)
+        .limit(limit + 1)
+        .to_list(length=limit + 1)
+    )
+    next_cursor = None
+    if len(docs) > limit:
+        docs = docs[:limit]
+        if offset + limit <= MAX_RANKED_OFFSET:
+            next_cursor = encode_offset_cursor(offset + limit)
+    return docs, next_cursor
+
+async def _next(mongo_cursor):
+    try:
+        return await mongo_cursor.__anext__()
+    except StopAsyncIteration:
+        return None
+
+async def _merged(hot_cursor, archive_cursor):
+    # Both cursors are sorted by _id descending; interleave them, hot copy first
+    hot, archived = await _next(hot_cursor), await _next(archive_cursor)
+    while hot is not None or archived is not None:
+        if archived is None or (hot is not None and hot["_id"] >= archived["_id"]):
+            if archived is not None and archived["_id"] == hot["_id"]:
+                archived = await _next(archive_cursor)
+            yield hot
+            hot = await _next(hot_cursor)
+        else:
+            yield archived
+            archived = await _next(archive_cursor)
+
+def stream_documents(collection, query: dict, encode, media_type: str, limit: Optional[int] = None, cursor: Optional[str] = None,
+                     projection: Optional[dict] = None, headers: Optional[dict] = None, archive=None, preamble: bytes = b""):
+    # Streams straight off batched cursors, newest first, in chunks of about
+    # STREAM_CHUNK_BYTES, so memory stays bounded however many documents match
+    if cursor:
+        query = {**query, "_id": {"$lt": decode_cursor(cursor)}}
+    tiers = [collection] if archive is None else [collection, archive]
+    mongo_cursors = [tier.find(query, projection).sort("_id", -1).batch_size(STREAM_BATCH_SIZE) for tier in tiers]
+    if limit is not None:
+        limit = page_size(limit)
+        mongo_cursors = [mongo_cursor.limit(limit) for mongo_cursor in mongo_cursors]
+
+    async def generate():
+        docs = mongo_cursors[0] if archive is None else _merged(*mongo_cursors)
+        sent = 0
+        chunk = bytearray()
+        if preamble:
+            yield preamble
+        try:
+            async for doc in docs:
+                chunk += encode(doc)
+                if len(chunk) >= STREAM_CHUNK_BYTES:
+                    yield bytes(chunk)
+                    chunk.clear()
+                sent += 1
+                if limit is not None and sent >= limit:
+                    break
+            if chunk:
+                yield bytes(chunk)
+        finally:
+            for mongo_cursor in mongo_cursors:
+                await mongo_cursor.close()
+
+    return StreamingResponse(generate(), media_type=media_type, headers=headers)
+
+def stream_ndjson(collection, query: dict, limit: Optional[int] = None, cursor: Optional[str] = None,
+                  projection: Optional[dict] = None, headers: Optional[dict] = None, archive=None):
+    return stream_documents(
+        collection, query, lambda doc: dumps(doc) + b"\n", "application/x-ndjson",
+        limit, cursor, projection, headers, archive,
+    )
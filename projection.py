@@ -0,0 +1,56 @@
+from typing import Optional
+
+from fastapi import HTTPException
+
+_REQUEST_SUMMARY = ("service_type", "vehicle", "status", "created_at", "updated_at")
+_VEHICLE = ("vehicle", "vehicle.make", "vehicle.model", "vehicle.year")
+
+# Fields each role may ask for on a list route, keyed by (collection, role).
+# Anything else, e.g. a mechanic's pending update shown to a customer, is rejected.
+ALLOWED_FIELDS = {
+    ("service_requests", "customer"): (
+        "service_type", "description", *_VEHICLE, "mechanic_id", "status", "created_at", "updated_at",
+        "bill", "billed_at", "update_status",
+    ),
+    ("service_requests", "mechanic"): (
+        "service_type", "description", *_VEHICLE, "customer_id", "mechanic_id", "status", "created_at", "updated_at",
+        "mechanic_update", "update_status", "inventories",
+    ),
+    ("service_requests", "admin"): (
+        "service_type", "description", *_VEHICLE, "customer_id", "mechanic_id", "status", "created_at", "updated_at",
+        "bill", "billed_at", "mechanic_update", "update_status", "inventories",
+    ),
+    ("transactions", "customer"): ("service_request_id", "amount", "payment_method", "status", "created_at"),
+    ("transactions", "admin"): ("customer_id", "service_request_id", "amount", "payment_method", "status", "created_at"),
+}
+
+# Compact projection per route when no fields= is given; fields=all returns every allowed field
+DEFAULT_FIELDS = {
+    "customer.get_customer_requests": (*_REQUEST_SUMMARY, "bill", "update_status"),
+    "customer.get_completed_transactions": ("service_request_id", "amount", "payment_method", "created_at"),
+    "mechanic.get_assigned_requests": (*_REQUEST_SUMMARY, "description", "update_status"),
+    "mechanic.get_completed_requests": _REQUEST_SUMMARY,
+    "mechanic.get_all_service_requests": (*_REQUEST_SUMMARY, "customer_id", "mechanic_id", "update_status"),
+    "admin.get_service_requests": (*_REQUEST_SUMMARY, "customer_id", "mechanic_id", "update_status"),
+    "admin.get_completed_requests": (*_REQUEST_SUMMARY, "customer_id", "mechanic_id", "bill"),
+    "admin.search_service_requests": (*_REQUEST_SUMMARY, "description", "customer_id", "mechanic_id"),
+    "admin.get_all_completed_transactions": ("customer_id", "service_request_id", "amount", "payment_method", "created_at"),
+}
+
+def build_projection(route: str, collection: str, role: str, fields: Optional[str] = None):
+    allowed = ALLOWED_FIELDS[(collection, role)]
+    if not fields:
+        names = DEFAULT_FIELDS[route]
+    elif fields == "all":
+        names = allowed
+    else:
+        names = [name.strip() for name in fields.split(",") if name.strip()]
+        unknown = [name for name in names if name not in allowed]
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown or disallowed fields: {', '.join(unknown)}")
+    # A sub-field is redundant (and a path collision for Mongo) once its parent is selected
+    selected = set(names)
+    projection = {name: 1 for name in names if name.split(".", 1)[0] == name or name.split(".", 1)[0] not in selected}
+    # Pagination cursors are built from _id, so it is always returned
+    projection["_id"] = 1
+    return projection
@@ -0,0 +1,113 @@
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from fastapi import HTTPException
+from pymongo import ReturnDocument
+
+# Token buckets in front of the login and register routes, which each cost a
+# bcrypt hash. A bucket holds up to `capacity` attempts and refills at
+# `capacity / period_seconds` per second.
+# "memory": per worker, bounded LRU of buckets (the default, single worker).
+# "mongo": one bucket document per key shared by all workers, expired by a TTL index.
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory")
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000"))
+RATE_LIMITS = "rate_limits"
+
+class MemoryBuckets:
+    # (tokens, last refill) per key; the least recently used key is evicted once
+    # max_keys is reached, which at worst hands that key a full bucket again
+    def __init__(self, max_keys=RATE_LIMIT_MAX_KEYS):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    async def take(self, key, capacity, rate):
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return allowed, tokens
+
+    def size(self):
+        with self._lock:
+            return len(self._buckets)
+
+class MongoBuckets:
+    # Refill and take in one pipeline update against the server clock, so workers
+    # with drifting clocks still agree; a bucket expires once it would be full again
+    async def take(self, key, capacity, rate):
+        from database import async_db as db
+        elapsed = {"$divide": [{"$subtract": ["$$NOW", {"$ifNull": ["$updated_at", "$$NOW"]}]}, 1000]}
+        refilled = {"$min": [capacity, {"$add": [{"$ifNull": ["$tokens", capacity]}, {"$multiply": [elapsed, rate]}]}]}
+        bucket = await db[RATE_LIMITS].find_one_and_update(
+            {"_id": key},
+            [
+                {"$set": {"tokens": refilled, "updated_at": "$$NOW"}},
+                {"$set": {"allowed": {"$gte": ["$tokens", 1]}}},
+                {"$set": {
+                    "tokens": {"$cond": ["$allowed", {"$subtract": ["$tokens", 1]}, "$tokens"]},
+                    "expires_at": {"$add": ["$$NOW", int(capacity / rate * 1000)]},
+                }},
+            ],
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        return bucket["allowed"], bucket["tokens"]
+
+    def size(self):
+        return None
+
+_buckets = MongoBuckets() if RATE_LIMIT_BACKEND == "mongo" else MemoryBuckets()
+
+class RateLimit:
+    def __init__(self, name, capacity, period_seconds):
+        self.name = name
+        self.capacity = capacity
+        self.rate = capacity / period_seconds
+        self.limited = 0
+
+    async def check(self, key):
+        allowed, tokens = await _buckets.take(f"{self.name}:{key}", self.capacity, self.rate)
+        if not allowed:
+            self.limited += 1
+            retry_after = max(1, math.ceil((1 - tokens) / self.rate))
+            raise HTTPException(status_code=429, detail="Too many attempts, please retry later",
+                                headers={"Retry-After": str(retry_after)})
+
+# One client address may try many accounts (shared NAT), one account is only
+# tried by a person, so the per-email bucket is the tighter one
+login_by_ip = RateLimit(
+    "login:ip", int(os.getenv("LOGIN_RATE_PER_IP", "20")), float(os.getenv("LOGIN_RATE_PER_IP_SECONDS", "60")))
+login_by_email = RateLimit(
+    "login:email", int(os.getenv("LOGIN_RATE_PER_EMAIL", "5")), float(os.getenv("LOGIN_RATE_PER_EMAIL_SECONDS", "60")))
+register_by_ip = RateLimit(
+    "register:ip", int(os.getenv("REGISTER_RATE_PER_IP", "5")), float(os.getenv("REGISTER_RATE_PER_IP_SECONDS", "600")))
+
+def _client_ip(request):
+    # run.py enables proxy headers, so behind a trusted proxy this is the forwarded address
+    return request.client.host if request.client else "unknown"
+
+async def check_login(request, email):
+    await login_by_ip.check(_client_ip(request))
+    await login_by_email.check(email.strip().lower())
+
+async def check_register(request, email):
+    await register_by_ip.check(_client_ip(request))
+    await login_by_email.check(email.strip().lower())
+
+def stats():
+    return {
+        "backend": RATE_LIMIT_BACKEND,
+        "keys": _buckets.size(),
+        "limited": {limit.name: limit.limited for limit in (login_by_ip, login_by_email, register_by_ip)},
+    }
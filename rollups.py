@@ -0,0 +1,174 @@
+import argparse
+import asyncio
+import logging
+import sys
+from collections import defaultdict
+from datetime import datetime
+
+from pymongo import UpdateOne
+
+from archive import SERVICE_REQUESTS_ARCHIVE, TRANSACTIONS_ARCHIVE
+from indexes import INDEXES
+
+logger = logging.getLogger(__name__)
+
+# rollups_daily:    _id {day, service_type, mechanic_id} -> created, completed, bills, billed_amount, payments, revenue
+# rollups_workload: _id {service_type, mechanic_id}      -> status.<status> (current number of requests)
+DAILY = "rollups_daily"
+WORKLOAD = "rollups_workload"
+TIERS = (("service_requests", "transactions"), (SERVICE_REQUESTS_ARCHIVE, TRANSACTIONS_ARCHIVE))
+
+def _day(moment=None):
+    return (moment or datetime.utcnow()).strftime("%Y-%m-%d")
+
+def _day_expression(field):
+    return {"$dateToString": {"format": "%Y-%m-%d", "date": field}}
+
+def _status_field(status):
+    # Status values come from clients; keep them usable as a field name
+    return "status." + str(status).replace(".", "_").lstrip("$")
+
+def _daily_key(request, day):
+    return {"day": day, "service_type": request.get("service_type"), "mechanic_id": request.get("mechanic_id")}
+
+def _workload_key(request):
+    return {"service_type": request.get("service_type"), "mechanic_id": request.get("mechanic_id")}
+
+def _inc(key, increments):
+    return UpdateOne({"_id": key}, {"$inc": increments}, upsert=True)
+
+def created_operations(request):
+    return [
+        (DAILY, _inc(_daily_key(request, _day(request.get("created_at"))), {"created": 1})),
+        (WORKLOAD, _inc(_workload_key(request), {_status_field(request.get("status")): 1})),
+    ]
+
+def status_change_operations(previous, new_status):
+    old_status = previous.get("status")
+    if old_status == new_status:
+        return []
+    operations = [(WORKLOAD, _inc(_workload_key(previous), {_status_field(old_status): -1, _status_field(new_status): 1}))]
+    if "completed" in (old_status, new_status):
+        operations.append((DAILY, _inc(_daily_key(previous, _day()), {"completed": 1 if new_status == "completed" else -1})))
+    return operations
+
+def bill_operations(request, amount):
+    # Re-billing a request replaces its previous amount instead of counting a second bill
+    previous_bill = request.get("bill")
+    if previous_bill:
+        increments = {"billed_amount": amount - float(previous_bill.get("amount", 0))}
+    else:
+        increments = {"bills": 1, "billed_amount": amount}
+    return [(DAILY, _inc(_daily_key(request, _day()), increments))]
+
+def payment_operations(request, amount):
+    return [(DAILY, _inc(_daily_key(request, _day()), {"payments": 1, "revenue": amount}))]
+
+async def apply(db, operations):
+    by_collection = defaultdict(list)
+    for collection, operation in operations:
+        by_collection[collection].append(operation)
+    await asyncio.gather(*(db[collection].bulk_write(ops, ordered=False) for collection, ops in by_collection.items()))
+
+async def revenue_summary(db, start, end, group_by):
+    group_ids = {"day": "$_id.day", "service_type": "$_id.service_type", "mechanic": "$_id.mechanic_id"}
+    pipeline = [
+        {"$match": {"_id.day": {"$gte": start, "$lte": end}}},
+        {"$group": {
+            "_id": group_ids[group_by],
+            "created": {"$sum": "$created"},
+            "completed": {"$sum": "$completed"},
+            "bills": {"$sum": "$bills"},
+            "billed_amount": {"$sum": "$billed_amount"},
+            "payments": {"$sum": "$payments"},
+            "revenue": {"$sum": "$revenue"},
+        }},
+        {"$sort": {"_id": 1}},
+    ]
+    return await db[DAILY].aggregate(pipeline).to_list(length=None)
+
+async def workload_summary(db):
+    return await db[WORKLOAD].find().to_list(length=None)
+
+def _add_tier_rows(db, requests_collection, transactions_collection, daily, workload):
+    requests = db[requests_collection].aggregate([
+        {"$project": {
+            "service_type": 1, "mechanic_id": 1, "status": 1, "bill": 1,
+            "created_day": _day_expression({"$ifNull": ["$created_at", {"$toDate": "$_id"}]}),
+            "updated_day": _day_expression({"$ifNull": ["$updated_at", {"$ifNull": ["$created_at", {"$toDate": "$_id"}]}]}),
+            "billed_day": _day_expression({"$ifNull": ["$billed_at", {"$ifNull": ["$created_at", {"$toDate": "$_id"}]}]}),
+        }},
+    ])
+    for request in requests:
+        daily[(request["created_day"], request.get("service_type"), request.get("mechanic_id"))]["created"] += 1
+        if request.get("status") == "completed":
+            daily[(request["updated_day"], request.get("service_type"), request.get("mechanic_id"))]["completed"] += 1
+        if request.get("bill"):
+            row = daily[(request["billed_day"], request.get("service_type"), request.get("mechanic_id"))]
+            row["bills"] += 1
+            row["billed_amount"] += float(request["bill"].get("amount", 0))
+        workload[(request.get("service_type"), request.get("mechanic_id"))][_status_field(request.get("status"))] += 1
+
+    payments = db[transactions_collection].aggregate([
+        {"$match": {"status": "completed"}},
+        {"$lookup": {
+            "from": requests_collection,
+            "let": {"request_id": {"$toObjectId": "$service_request_id"}},
+            "pipeline": [{"$match": {"$expr": {"$eq": ["$_id", "$$request_id"]}}}, {"$project": {"service_type": 1, "mechanic_id": 1}}],
+            "as": "request",
+        }},
+        {"$project": {"amount": 1, "day": _day_expression("$created_at"), "request": {"$first": "$request"}}},
+    ])
+    for payment in payments:
+        request = payment.get("request") or {}
+        row = daily[(payment["day"], request.get("service_type"), request.get("mechanic_id"))]
+        row["payments"] += 1
+        row["revenue"] += float(payment.get("amount", 0))
+
+def _rebuilt_rows(db):
+    daily = defaultdict(lambda: defaultdict(int))
+    workload = defaultdict(lambda: defaultdict(int))
+
+    # Both tiers count; run it while the archival job is idle so no request is seen in both
+    for requests_collection, transactions_collection in TIERS:
+        _add_tier_rows(db, requests_collection, transactions_collection, daily, workload)
+
+    daily_rows = [
+        {"_id": {"day": day, "service_type": service_type, "mechanic_id": mechanic_id}, **counters}
+        for (day, service_type, mechanic_id), counters in daily.items()
+    ]
+    workload_rows = []
+    for (service_type, mechanic_id), counters in workload.items():
+        statuses = {field.split(".", 1)[1]: count for field, count in counters.items()}
+        workload_rows.append({"_id": {"service_type": service_type, "mechanic_id": mechanic_id}, "status": statuses})
+    return daily_rows, workload_rows
+
+def rebuild(db):
+    # Recompute both rollups from the raw collections into staging collections and swap them in.
+    # Writes that land while the rebuild runs are not reflected, so run it during a quiet period.
+    daily_rows, workload_rows = _rebuilt_rows(db)
+    for name, rows in ((DAILY, daily_rows), (WORKLOAD, workload_rows)):
+        staging = db[name + "_rebuild"]
+        staging.drop()
+        if rows:
+            staging.insert_many(rows)
+            if INDEXES.get(name):
+                staging.create_indexes(INDEXES[name])
+            staging.rename(name, dropTarget=True)
+        else:
+            db[name].drop()
+        logger.info("Rebuilt %s with %d rows", name, len(rows))
+    return {DAILY: len(daily_rows), WORKLOAD: len(workload_rows)}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Maintain the admin dashboard rollups")
+    parser.add_argument("command", choices=["rebuild"])
+    parser.parse_args(argv)
+
+    from database import db
+    for name, count in rebuild(db).items():
+        print(f"{name}: {count} rows")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
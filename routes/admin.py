@@ -1,46 +1,125 @@
-from fastapi import APIRouter, Depends, HTTPException
-from models import UserCreate, UserLogin, ServiceRequestModel
-from database import db
-from auth import hash_password, verify_password, create_access_token, get_current_user
-from datetime import datetime
+from fastapi import APIRouter, Depends, HTTPException, Request
+from models import UserCreate, UserLogin, ServiceRequestModel, InventoryUsageModel
+from database import async_db as db
+from auth import hash_password_async, check_password, create_access_token, get_current_user, user_cache
+from serialization import BSONResponse
+from bulk import bulk_update_by_id, check_batch_size
+from pagination import build_filter, fetch_page, fetch_ranked_page, stream_ndjson
+from projection import build_projection
+from datetime import date, datetime
 from bson import ObjectId
-from pydantic import BaseModel
+from pymongo.errors import DuplicateKeyError
+from pydantic import BaseModel, conint
+import archive
+import dashboard
+import export
+import inventory
+import lifecycle
+import ratelimit
+import rollups
+import versions
+from typing import List, Literal, Optional
 
 router = APIRouter(prefix="/admin", tags=["Admin"])
 
 @router.post("/register")
-def register_admin(user: UserCreate):
-    if db.users.find_one({"email": user.email}):
+async def register_admin(user: UserCreate, request: Request):
+    await ratelimit.check_register(request, user.email)
+    # Cheap check before paying for the bcrypt hash
+    if await db.users.find_one({"email": user.email}, {"_id": 1}):
         raise HTTPException(status_code=400, detail="Admin already exists")
     user_data = user.dict()
-    user_data["password"] = hash_password(user.password)
+    user_data["password"] = await hash_password_async(user.password)
     user_data["role"] = "admin"
-    db.users.insert_one(user_data)
+    # The unique email index (required at startup) rejects a concurrent duplicate
+    try:
+        await db.users.insert_one(user_data)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="Admin already exists")
+    user_cache.invalidate(user.email)
     return {"message": "Admin registered successfully"}
 
 @router.post("/login")
-def login_admin(user: UserLogin):
-    found = db.users.find_one({"email": user.email, "role": "admin"})
-    if not found or not verify_password(user.password, found["password"]):
+async def login_admin(user: UserLogin, request: Request):
+    await ratelimit.check_login(request, user.email)
+    found = await db.users.find_one({"email": user.email, "role": "admin"})
+    if not found or not await check_password(found, user.password):
         raise HTTPException(status_code=401, detail="Invalid credentials")
     token = create_access_token({"sub": user.email, "role": "admin"})
     return {"access_token": token, "token_type": "bearer"}
 
+@router.get("/auth_cache_stats")
+async def get_auth_cache_stats(user=Depends(get_current_user)):
+    if user["role"] != "admin":
+        raise HTTPException(status_code=403, detail="Only admins can view cache statistics")
+    return user_cache.stats()
+
 @router.get("/service_requests")
-def get_service_requests(user=Depends(get_current_user)):
+async def get_service_requests(
+    request: Request,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    status: Optional[str] = None,
+    created_after: Optional[datetime] = None,
+    created_before: Optional[datetime] = None,
+    fields: Optional[str] = None,
+    stream: bool = False,
+    user=Depends(get_current_user),
+):
     if user["role"] != "admin":
         raise HTTPException(status_code=403, detail="Only admins can view service requests")
+    projection = build_projection("admin.get_service_requests", "service_requests", "admin", fields)
+    cache_headers, not_modified = await versions.conditional(db, request, [versions.scope("service_requests")])
+    if not_modified:
+        return not_modified
 
-    # Fetch service requests and convert ObjectId to string
-    service_requests = list(db.service_requests.find())
-    for request in service_requests:
-        request["_id"] = str(request["_id"])  # Convert ObjectId to string
-        if "customer_id" in request:
-            request["customer_id"] = str(request["customer_id"])  # Convert customer_id if present
-    return {"service_requests": service_requests}
+    query = build_filter({}, status, created_after, created_before)
+    if stream:
+        return stream_ndjson(db.service_requests, query, limit, cursor, projection, cache_headers)
+
+    # Fetch one page of service requests
+    service_requests, next_cursor = await fetch_page(db.service_requests, query, limit, cursor, projection)
+    return BSONResponse({"service_requests": service_requests, "next_cursor": next_cursor}, headers=cache_headers)
+
+@router.get("/search_service_requests")
+async def search_service_requests(
+    request: Request,
+    q: Optional[str] = None,
+    make: Optional[str] = None,
+    model: Optional[str] = None,
+    year: Optional[int] = None,
+    status: Optional[str] = None,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    user=Depends(get_current_user),
+):
+    if user["role"] != "admin":
+        raise HTTPException(status_code=403, detail="Only admins can search service requests")
+    if not (q or make or model or year):
+        raise HTTPException(status_code=400, detail="Provide q or at least one of make, model, year")
+    # Structured search is indexed from make; model or year alone would scan the collection
+    if not q and not make:
+        raise HTTPException(status_code=400, detail="make is required when searching by model or year without q")
+    projection = build_projection("admin.search_service_requests", "service_requests", "admin", fields)
+    cache_headers, not_modified = await versions.conditional(db, request, [versions.scope("service_requests")])
+    if not_modified:
+        return not_modified
+
+    query = build_filter({}, status)
+    for field, value in (("vehicle.make", make), ("vehicle.model", model), ("vehicle.year", year)):
+        if value is not None:
+            query[field] = value
+    if q:
+        # Text matches are ranked by relevance across service type, vehicle and description
+        query["$text"] = {"$search": q}
+        service_requests, next_cursor = await fetch_ranked_page(db.service_requests, query, limit, cursor, projection)
+    else:
+        service_requests, next_cursor = await fetch_page(db.service_requests, query, limit, cursor, projection)
+    return BSONResponse({"service_requests": service_requests, "next_cursor": next_cursor}, headers=cache_headers)
 
 @router.post("/update_service_status/{request_id}")
-def update_service_status(request_id: str, payload: dict, user=Depends(get_current_user)):
+async def update_service_status(request_id: str, payload: dict, user=Depends(get_current_user)):
     if user["role"] != "admin":
         raise HTTPException(status_code=403, detail="Only admins can update service status")
     
@@ -48,47 +127,132 @@ def update_service_status(request_id: str, payload: dict, user=Depends(get_curre
     if not status:
         raise HTTPException(status_code=400, detail="Status is required")
     
-    result = db.service_requests.update_one(
+    previous = await db.service_requests.find_one_and_update(
         {"_id": ObjectId(request_id)},
-        {"$set": {"status": status, "updated_at": datetime.utcnow()}}
+        {"$set": {"status": status, "updated_at": datetime.utcnow()}},
+        projection=lifecycle.REQUEST_FIELDS
     )
-    if result.matched_count == 0:
+    if previous is None:
         raise HTTPException(status_code=404, detail="Service request not found")
-    
+    await lifecycle.status_changed(previous, status)
+
     return {"message": "Service request status updated"}
 
+@router.get("/dashboard/revenue")
+async def get_revenue_dashboard(
+    start: date,
+    end: date,
+    group_by: Literal["day", "service_type", "mechanic"] = "day",
+    user=Depends(get_current_user),
+):
+    if user["role"] != "admin":
+        raise HTTPException(status_code=403, detail="Only admins can view dashboards")
+    if end < start:
+        raise HTTPException(status_code=400, detail="end must not be before start")
+
+    groups = await rollups.revenue_summary(db, start.isoformat(), end.isoformat(), group_by)
+    totals = {field: sum(group[field] for group in groups) for field in ("created", "completed", "bills", "billed_amount", "payments", "revenue")}
+    return BSONResponse({"group_by": group_by, "totals": totals, "groups": groups})
+
+@router.get("/dashboard/workload")
+async def get_workload_dashboard(user=Depends(get_current_user)):
+    if user["role"] != "admin":
+        raise HTTPException(status_code=403, detail="Only admins can view dashboards")
+
+    rows = await rollups.workload_summary(db)
+    by_status = {}
+    by_mechanic = {}
+    for row in rows:
+        mechanic = by_mechanic.setdefault(row["_id"]["mechanic_id"], {})
+        for status, count in row.get("status", {}).items():
+            by_status[status] = by_status.get(status, 0) + count
+            mechanic[status] = mechanic.get(status, 0) + count
+    return BSONResponse({"by_status": by_status, "by_mechanic": by_mechanic, "rows": rows})
+
+@router.get("/dashboard/mechanics")
+async def get_mechanics_dashboard(recent: int = 5, user=Depends(get_current_user)):
+    if user["role"] != "admin":
+        raise HTTPException(status_code=403, detail="Only admins can view dashboards")
+    dashboard.check_recent(recent)
+    return BSONResponse(await dashboard.shop_dashboard(db, recent))
+
+class StatusUpdateItem(BaseModel):
+    request_id: str
+    status: str
+
+@router.post("/bulk_update_service_status")
+async def bulk_update_service_status(updates: List[StatusUpdateItem], user=Depends(get_current_user)):
+    if user["role"] != "admin":
+        raise HTTPException(status_code=403, detail="Only admins can update service status")
+    check_batch_size(updates)
+
+    now = datetime.utcnow()
+    return await bulk_update_by_id(
+        db.service_requests,
+        [(item.request_id, {"status": item.status, "updated_at": now}) for item in updates],
+        on_updated=lambda applied: lifecycle.statuses_changed([(previous, fields["status"], fields) for previous, fields in applied]),
+    )
+
 class VerifyUpdateModel(BaseModel):
     verified: bool
 
 @router.post("/verify_update/{request_id}")
-def verify_update(request_id: str, verify_request: VerifyUpdateModel, user=Depends(get_current_user)):
+async def verify_update(request_id: str, verify_request: VerifyUpdateModel, user=Depends(get_current_user)):
     if user["role"] != "admin":
         raise HTTPException(status_code=403, detail="Only admins can verify updates")
     
-    update_data = {"update_status": "verified" if verify_request.verified else "rejected"}
+    update_data = {"update_status": "verified" if verify_request.verified else "rejected", "updated_at": datetime.utcnow()}
+    # A pending update stays reviewable after the request is closed (e.g. the
+    # mechanic marked it complete first); the same condition as the dashboards
+    pending = {"_id": ObjectId(request_id), **dashboard.PENDING_VERIFICATION}
+
+    previous = None
     if verify_request.verified:
-        update_data["status"] = "completed"  # Example: Mark as completed if verified
-    
-    result = db.service_requests.update_one(
-        {"_id": ObjectId(request_id)},
-        {"$set": update_data}
-    )
-    if result.matched_count == 0:
-        raise HTTPException(status_code=404, detail="Service request not found")
-    
+        # Verifying also marks the request completed (example), unless it is already closed
+        completed = {**update_data, "status": "completed"}
+        previous = await db.service_requests.find_one_and_update(
+            {**pending, **lifecycle.OPEN}, {"$set": completed}, projection=lifecycle.REQUEST_FIELDS
+        )
+        if previous is not None:
+            await lifecycle.status_changed(previous, "completed", completed)
+    if previous is None:
+        previous = await db.service_requests.find_one_and_update(
+            pending, {"$set": update_data}, projection=lifecycle.REQUEST_FIELDS
+        )
+        if previous is None:
+            await lifecycle.raise_transition_error(
+                {"_id": ObjectId(request_id)}, "Service request not found", "Service request has no update pending verification"
+            )
+        await lifecycle.request_updated(previous, update_data)
+
     return {"message": "Update verification completed"}
 
 @router.get("/completed_transactions")
-def get_all_completed_transactions(user=Depends(get_current_user)):
+async def get_all_completed_transactions(
+    request: Request,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    created_after: Optional[datetime] = None,
+    created_before: Optional[datetime] = None,
+    fields: Optional[str] = None,
+    stream: bool = False,
+    user=Depends(get_current_user),
+):
     if user["role"] != "admin":
         raise HTTPException(status_code=403, detail="Only admins can view completed transactions")
-    
-    transactions = list(db.transactions.find({"status": "completed"}))
-    for transaction in transactions:
-        transaction["_id"] = str(transaction["_id"])  # Convert ObjectId to string
-        transaction["customer_id"] = str(transaction["customer_id"])  # Convert customer_id
-        transaction["service_request_id"] = str(transaction["service_request_id"])  # Convert service_request_id
-    return {"completed_transactions": transactions}
+    projection = build_projection("admin.get_all_completed_transactions", "transactions", "admin", fields)
+    cache_headers, not_modified = await versions.conditional(db, request, [versions.scope("transactions")])
+    if not_modified:
+        return not_modified
+
+    query = build_filter({}, "completed", created_after, created_before)
+    archived = db[archive.TRANSACTIONS_ARCHIVE]
+    if stream:
+        return stream_ndjson(db.transactions, query, limit, cursor, projection, cache_headers, archive=archived)
+
+    # Fetch one page of completed transactions from both tiers
+    transactions, next_cursor = await fetch_page(db.transactions, query, limit, cursor, projection, archive=archived)
+    return BSONResponse({"completed_transactions": transactions, "next_cursor": next_cursor}, headers=cache_headers)
 
 class BillModel(BaseModel):
     service_request_id: str
@@ -96,88 +260,183 @@ class BillModel(BaseModel):
     description: str
 
 @router.post("/generate_bill")
-def generate_bill(bill: BillModel, user=Depends(get_current_user)):
+async def generate_bill(bill: BillModel, user=Depends(get_current_user)):
     if user["role"] != "admin":
         raise HTTPException(status_code=403, detail="Only admins can generate bills")
 
-    # Check if the service request exists
-    service_request = db.service_requests.find_one({"_id": ObjectId(bill.service_request_id)})
-    if not service_request:
-        raise HTTPException(status_code=404, detail="Service request not found")
-
-    # Insert the bill into the service request
-    result = db.service_requests.update_one(
-        {"_id": ObjectId(bill.service_request_id)},
-        {"$set": {"bill": {"amount": bill.amount, "description": bill.description}}}
+    # Insert the bill into the service request; rejected requests can't be billed.
+    # The previous bill comes back with the document so the rollups can adjust it.
+    bill_data = {"amount": bill.amount, "description": bill.description}
+    now = datetime.utcnow()
+    previous = await db.service_requests.find_one_and_update(
+        {"_id": ObjectId(bill.service_request_id), "status": {"$ne": "rejected"}},
+        {"$set": {"bill": bill_data, "billed_at": now, "updated_at": now}},
+        projection={**lifecycle.REQUEST_FIELDS, "bill": 1}
     )
-    if result.matched_count == 0:
-        raise HTTPException(status_code=404, detail="Failed to generate bill")
+    if previous is None:
+        await lifecycle.raise_transition_error(
+            {"_id": ObjectId(bill.service_request_id)}, "Service request not found", "Cannot bill a rejected service request"
+        )
+    await lifecycle.bill_generated(previous, bill_data)
 
     return {"message": "Bill generated successfully"}
 
 @router.post("/record_inventory/{request_id}")
-def record_inventory(request_id: str, inventory: dict, user=Depends(get_current_user)):
+async def record_inventory(request_id: str, inventory_usage: InventoryUsageModel, user=Depends(get_current_user)):
     if user["role"] != "mechanic":
         raise HTTPException(status_code=403, detail="Only mechanics can record inventory usage")
     
-    result = db.service_requests.update_one(
-        {"_id": ObjectId(request_id)},
-        {"$push": {"inventories": inventory}}
-    )
-    if result.matched_count == 0:
+    service_request = await db.service_requests.find_one({"_id": ObjectId(request_id)}, lifecycle.REQUEST_FIELDS)
+    if service_request is None:
         raise HTTPException(status_code=404, detail="Service request not found")
+
+    # Usage goes to the inventory ledger instead of growing the service request
+    inventory_data = inventory_usage.dict()
+    inventory_data["mechanic_id"] = str(user["_id"])
+    inventory_data["service_request_id"] = request_id
+    usage = await inventory.record_one(db, inventory_data)
+    await lifecycle.inventory_recorded(service_request, usage)
     return {"message": "Inventory recorded successfully"}
 
+class RestockModel(BaseModel):
+    item_name: str
+    quantity: conint(gt=0)
+
+@router.post("/inventory/restock")
+async def restock_inventory(restock: RestockModel, user=Depends(get_current_user)):
+    if user["role"] != "admin":
+        raise HTTPException(status_code=403, detail="Only admins can restock inventory")
+    stock = await inventory.restock(db, restock.item_name, restock.quantity)
+    return BSONResponse({"message": "Inventory restocked successfully", "stock": stock})
+
+@router.get("/inventory/stock")
+async def get_inventory_stock(item_name: Optional[str] = None, user=Depends(get_current_user)):
+    if user["role"] != "admin":
+        raise HTTPException(status_code=403, detail="Only admins can view inventory stock")
+    return BSONResponse({"stock": await inventory.stock_levels(db, item_name)})
+
+@router.get("/inventory/usage")
+async def get_inventory_usage(start: date, end: date, item_name: Optional[str] = None, user=Depends(get_current_user)):
+    if user["role"] != "admin":
+        raise HTTPException(status_code=403, detail="Only admins can view inventory usage")
+    if end < start:
+        raise HTTPException(status_code=400, detail="end must not be before start")
+    items = await inventory.usage_summary(db, start.isoformat(), end.isoformat(), item_name)
+    return BSONResponse({"items": items})
+
+@router.get("/inventory/usage/{service_request_id}")
+async def get_request_inventory_usage(service_request_id: str, user=Depends(get_current_user)):
+    if user["role"] != "admin":
+        raise HTTPException(status_code=403, detail="Only admins can view inventory usage")
+    return BSONResponse({"usage": await inventory.request_usage(db, service_request_id)})
+
+@router.get("/export/transactions")
+async def export_transactions(
+    format: Literal["csv", "ndjson"] = "csv",
+    status: Optional[str] = None,
+    created_after: Optional[datetime] = None,
+    created_before: Optional[datetime] = None,
+    user=Depends(get_current_user),
+):
+    if user["role"] != "admin":
+        raise HTTPException(status_code=403, detail="Only admins can export transactions")
+    query = export.export_filter(status, created_after, created_before)
+    return export.stream_export(db.transactions, "transactions", format, query, archive=db[archive.TRANSACTIONS_ARCHIVE])
+
+@router.get("/export/service_requests")
+async def export_service_requests(
+    format: Literal["csv", "ndjson"] = "csv",
+    status: Optional[str] = None,
+    created_after: Optional[datetime] = None,
+    created_before: Optional[datetime] = None,
+    user=Depends(get_current_user),
+):
+    if user["role"] != "admin":
+        raise HTTPException(status_code=403, detail="Only admins can export service requests")
+    query = export.export_filter(status, created_after, created_before)
+    return export.stream_export(db.service_requests, "service_requests", format, query, archive=db[archive.SERVICE_REQUESTS_ARCHIVE])
+
 @router.get("/completed_requests")
-def get_completed_requests(user=Depends(get_current_user)):
+async def get_completed_requests(
+    request: Request,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    created_after: Optional[datetime] = None,
+    created_before: Optional[datetime] = None,
+    fields: Optional[str] = None,
+    stream: bool = False,
+    user=Depends(get_current_user),
+):
     if user["role"] != "admin":
         raise HTTPException(status_code=403, detail="Only admins can view completed requests")
-    
-    # Fetch completed service requests and convert ObjectId to string
-    requests = list(db.service_requests.find({"status": "completed"}))
-    for req in requests:
-        req["_id"] = str(req["_id"])  # Convert ObjectId to string
-        if "customer_id" in req:
-            req["customer_id"] = str(req["customer_id"])  # Convert customer_id if present
-    return {"completed_requests": requests}
+    projection = build_projection("admin.get_completed_requests", "service_requests", "admin", fields)
+    cache_headers, not_modified = await versions.conditional(db, request, [versions.scope("service_requests")])
+    if not_modified:
+        return not_modified
+
+    query = build_filter({}, "completed", created_after, created_before)
+    archived = db[archive.SERVICE_REQUESTS_ARCHIVE]
+    if stream:
+        return stream_ndjson(db.service_requests, query, limit, cursor, projection, cache_headers, archive=archived)
+
+    # Fetch one page of completed service requests from both tiers
+    requests, next_cursor = await fetch_page(db.service_requests, query, limit, cursor, projection, archive=archived)
+    return BSONResponse({"completed_requests": requests, "next_cursor": next_cursor}, headers=cache_headers)
 
 class VerifyRequestModel(BaseModel):
     verified: bool
 
 @router.post("/verify_request/{request_id}")
-def verify_request(request_id: str, request: VerifyRequestModel, user=Depends(get_current_user)):
+async def verify_request(request_id: str, request: VerifyRequestModel, user=Depends(get_current_user)):
     if user["role"] != "admin":
         raise HTTPException(status_code=403, detail="Only admins can verify requests")
 
-    # Check if the service request exists
-    service_request = db.service_requests.find_one({"_id": ObjectId(request_id)})
-    if not service_request:
-        raise HTTPException(status_code=404, detail="Service request not found")
-
-    # Update the status based on verification
+    # Update the status based on verification; closed requests can't be re-verified
     new_status = "verified" if request.verified else "rejected"
-    db.service_requests.update_one(
-        {"_id": ObjectId(request_id)},
-        {"$set": {"status": new_status}}
+    previous = await db.service_requests.find_one_and_update(
+        {"_id": ObjectId(request_id), **lifecycle.OPEN},
+        {"$set": {"status": new_status, "updated_at": datetime.utcnow()}},
+        projection=lifecycle.REQUEST_FIELDS
     )
+    if previous is None:
+        await lifecycle.raise_transition_error({"_id": ObjectId(request_id)}, "Service request not found", "Service request is already closed")
+    await lifecycle.status_changed(previous, new_status)
 
     return {"message": f"Service request {new_status} successfully"}
 
 @router.post("/verify_service_request/{request_id}")
-def verify_service_request(request_id: str, request: VerifyRequestModel, user=Depends(get_current_user)):
+async def verify_service_request(request_id: str, request: VerifyRequestModel, user=Depends(get_current_user)):
     if user["role"] != "admin":
         raise HTTPException(status_code=403, detail="Only admins can verify service requests")
 
-    # Check if the service request exists
-    service_request = db.service_requests.find_one({"_id": ObjectId(request_id)})
-    if not service_request:
-        raise HTTPException(status_code=404, detail="Service request not found")
-
-    # Update the status based on verification
+    # Update the status based on verification; closed requests can't be re-verified
     new_status = "verified" if request.verified else "rejected"
-    db.service_requests.update_one(
-        {"_id": ObjectId(request_id)},
-        {"$set": {"status": new_status}}
+    previous = await db.service_requests.find_one_and_update(
+        {"_id": ObjectId(request_id), **lifecycle.OPEN},
+        {"$set": {"status": new_status, "updated_at": datetime.utcnow()}},
+        projection=lifecycle.REQUEST_FIELDS
     )
+    if previous is None:
+        await lifecycle.raise_transition_error({"_id": ObjectId(request_id)}, "Service request not found", "Service request is already closed")
+    await lifecycle.status_changed(previous, new_status)
 
     return {"message": f"Service request {new_status} successfully"}
+
+class VerifyRequestItem(BaseModel):
+    request_id: str
+    verified: bool
+
+@router.post("/bulk_verify_request")
+async def bulk_verify_request(requests: List[VerifyRequestItem], user=Depends(get_current_user)):
+    if user["role"] != "admin":
+        raise HTTPException(status_code=403, detail="Only admins can verify requests")
+    check_batch_size(requests)
+
+    now = datetime.utcnow()
+    return await bulk_update_by_id(
+        db.service_requests,
+        [(item.request_id, {"status": "verified" if item.verified else "rejected", "updated_at": now}) for item in requests],
+        on_updated=lambda applied: lifecycle.statuses_changed([(previous, fields["status"], fields) for previous, fields in applied]),
+        guard=lifecycle.OPEN,
+        conflict="Service request is already closed",
+    )
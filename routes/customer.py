@@ -1,13 +1,23 @@
 # backend/routes/customer.py
 
 from bson import ObjectId
-from fastapi import APIRouter, Depends, HTTPException
+from pymongo.errors import DuplicateKeyError
+from fastapi import APIRouter, Depends, HTTPException, Request
 from models import UserCreate, UserLogin, ServiceRequestModel
-from database import db
-from auth import hash_password, verify_password, create_access_token, get_current_user
+from database import async_db as db
+from auth import hash_password_async, check_password, create_access_token, get_current_user, get_event_stream_user, user_cache, create_event_ticket, EVENT_TICKET_EXPIRE_SECONDS
 from datetime import datetime
 from pydantic import BaseModel
-import random
+from assignment import assigner
+import archive
+import lifecycle
+import ratelimit
+import versions
+from events import event_stream
+from serialization import BSONResponse
+from projection import build_projection
+from pagination import fetch_all
+from typing import Optional
 
 router = APIRouter(prefix="/customer", tags=["Customer"])
 
@@ -19,83 +29,125 @@ class PaymentModel(BaseModel):
 
 # Customer registration
 @router.post("/register")
-def register(user: UserCreate):
-    if db.users.find_one({"email": user.email}):
+async def register(user: UserCreate, request: Request):
+    await ratelimit.check_register(request, user.email)
+    # Cheap check before paying for the bcrypt hash
+    if await db.users.find_one({"email": user.email}, {"_id": 1}):
         raise HTTPException(status_code=400, detail="User already exists")
     user_data = user.dict()
-    user_data["password"] = hash_password(user.password)
+    user_data["password"] = await hash_password_async(user.password)
     user_data["role"] = user_data.get("role", "customer")  # Default to "customer"
-    db.users.insert_one(user_data)
+    # The unique email index (required at startup) rejects a concurrent duplicate
+    try:
+        result = await db.users.insert_one(user_data)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="User already exists")
+    user_cache.invalidate(user.email)
+    if user_data["role"] == "mechanic":
+        assigner.add_mechanic(result.inserted_id, user.email)
     return {"message": "Registered successfully"}
 
 # Customer login
 @router.post("/login")
-def login_customer(user: UserLogin):
-    found = db.users.find_one({"email": user.email, "role": "customer"})
-    if not found or not verify_password(user.password, found["password"]):
+async def login_customer(user: UserLogin, request: Request):
+    await ratelimit.check_login(request, user.email)
+    found = await db.users.find_one({"email": user.email, "role": "customer"})
+    if not found or not await check_password(found, user.password):
         raise HTTPException(status_code=401, detail="Invalid credentials")
     token = create_access_token({"sub": user.email, "role": "customer"})
     return {"access_token": token, "token_type": "bearer"}
 
 # Schedule a service
 @router.post("/schedule_service")
-def schedule_service(request: ServiceRequestModel, user=Depends(get_current_user)):
+async def schedule_service(request: ServiceRequestModel, user=Depends(get_current_user)):
     if user["role"] != "customer":
         raise HTTPException(status_code=403, detail="Only customers can schedule services")
 
-    # Fetch all mechanics
-    mechanics = list(db.users.find({"role": "mechanic"}))
-    if not mechanics:
+    # Assign the mechanic with the fewest open requests
+    selected_mechanic = assigner.assign()
+    if selected_mechanic is None:
         raise HTTPException(status_code=404, detail="No mechanics available to assign the task")
-
-    # Randomly select a mechanic
-    selected_mechanic = random.choice(mechanics)
+    mechanic_id, mechanic_email = selected_mechanic
 
     # Insert service request details
     request_data = request.dict()
     request_data["customer_id"] = str(user["_id"])
-    request_data["mechanic_id"] = str(selected_mechanic["_id"])
+    request_data["mechanic_id"] = mechanic_id
     request_data["status"] = "pending"
-    request_data["created_at"] = datetime.utcnow()
-    db.service_requests.insert_one(request_data)
+    request_data["created_at"] = request_data["updated_at"] = datetime.utcnow()
+    try:
+        await db.service_requests.insert_one(request_data)
+    except Exception:
+        assigner.release(mechanic_id)
+        raise
+    await lifecycle.request_created(request_data)
 
-    return {"message": "Service request submitted successfully", "mechanic": selected_mechanic["email"]}
+    return {"message": "Service request submitted successfully", "mechanic": mechanic_email}
 
 # Get customer service requests
 @router.get("/service_requests")
-def get_customer_requests(user=Depends(get_current_user)):
+async def get_customer_requests(request: Request, fields: Optional[str] = None, user=Depends(get_current_user)):
     if user["role"] != "customer":
         raise HTTPException(status_code=403, detail="Only customers can view their service requests")
-    
-    # Fetch service requests for the customer
-    requests = list(db.service_requests.find({"customer_id": str(user["_id"])}))
-    filtered_requests = []
-    for req in requests:
-        req["_id"] = str(req["_id"])
-        req["mechanic_id"] = str(req.get("mechanic_id", ""))
-        if "bill" in req:
-            req["bill"]["amount"] = float(req["bill"]["amount"])  # Ensure amount is a float
-        
-        # Exclude completed transactions
-        completed_transaction = db.transactions.find_one({
-            "service_request_id": str(req["_id"]),
-            "status": "completed"
-        })
-        if not completed_transaction:
-            filtered_requests.append(req)
-
-    return {"service_requests": filtered_requests}
+    customer_id = str(user["_id"])
+    projection = build_projection("customer.get_customer_requests", "service_requests", "customer", fields)
+    cache_headers, not_modified = await versions.conditional(db, request, [
+        versions.scope("service_requests", "customer_id", customer_id),
+        versions.scope("transactions", "customer_id", customer_id),
+    ])
+    if not_modified:
+        return not_modified
+
+    # Fetch service requests for the customer, excluding those with a completed
+    # transaction, in a single aggregation instead of one lookup per request
+    pipeline = [
+        {"$match": {"customer_id": customer_id}},
+        {"$project": projection},
+        {"$lookup": {
+            "from": "transactions",
+            "let": {"request_id": {"$toString": "$_id"}},
+            "pipeline": [
+                {"$match": {"$expr": {"$eq": ["$service_request_id", "$$request_id"]}, "status": "completed"}},
+                {"$limit": 1},
+                {"$project": {"_id": 1}},
+            ],
+            "as": "completed_transactions",
+        }},
+        {"$match": {"completed_transactions": {"$size": 0}}},
+        {"$project": {"completed_transactions": 0}},
+    ]
+    filtered_requests = await db.service_requests.aggregate(pipeline).to_list(length=None)
+    return BSONResponse({"service_requests": filtered_requests}, headers=cache_headers)
+
+# Short-lived ticket for /events?ticket=, for EventSource clients
+@router.post("/events/ticket")
+async def create_events_ticket(user=Depends(get_current_user)):
+    if user["role"] != "customer":
+        raise HTTPException(status_code=403, detail="Only customers can subscribe to service request events")
+    return {"ticket": create_event_ticket(user), "expires_in": EVENT_TICKET_EXPIRE_SECONDS}
+
+# Stream changes to the customer's service requests
+@router.get("/events")
+async def stream_events(user=Depends(get_event_stream_user)):
+    if user["role"] != "customer":
+        raise HTTPException(status_code=403, detail="Only customers can subscribe to service request events")
+    return event_stream(str(user["_id"]))
 
 # Initiate payment
 @router.post("/initiate_payment")
-def initiate_payment(payment: PaymentModel, user=Depends(get_current_user)):
+async def initiate_payment(payment: PaymentModel, user=Depends(get_current_user)):
     if user["role"] != "customer":
         raise HTTPException(status_code=403, detail="Only customers can initiate payments")
 
     # Check if the service request exists and belongs to the customer
-    service_request = db.service_requests.find_one({"_id": ObjectId(payment.service_request_id), "customer_id": str(user["_id"])})
+    service_request = await db.service_requests.find_one(
+        {"_id": ObjectId(payment.service_request_id), "customer_id": str(user["_id"])},
+        {**lifecycle.REQUEST_FIELDS, "bill": 1}
+    )
     if not service_request:
         raise HTTPException(status_code=404, detail="Service request not found or does not belong to the customer")
+    if not service_request.get("bill"):
+        raise HTTPException(status_code=409, detail="Service request has not been billed yet")
 
     if payment.amount != service_request["bill"]["amount"]:
         raise HTTPException(status_code=400, detail="Payment amount does not match the bill")
@@ -109,22 +161,30 @@ def initiate_payment(payment: PaymentModel, user=Depends(get_current_user)):
         "status": "completed",
         "created_at": datetime.utcnow()
     }
-    inserted_id = db.transactions.insert_one(transaction_data).inserted_id
+    # A second completed payment for the same request violates the unique index
+    try:
+        inserted_id = (await db.transactions.insert_one(transaction_data)).inserted_id
+    except DuplicateKeyError:
+        raise HTTPException(status_code=409, detail="Service request has already been paid")
     transaction_data["_id"] = str(inserted_id)
+    await lifecycle.payment_completed(service_request, transaction_data)
 
     return {"message": "Payment completed successfully", "transaction": transaction_data}
 
 # Get completed transactions
 @router.get("/completed_transactions")
-def get_completed_transactions(user=Depends(get_current_user)):
+async def get_completed_transactions(request: Request, fields: Optional[str] = None, user=Depends(get_current_user)):
     if user["role"] != "customer":
         raise HTTPException(status_code=403, detail="Only customers can view their completed transactions")
-    
-    transactions = list(db.transactions.find({"customer_id": str(user["_id"]), "status": "completed"}))
-    for transaction in transactions:
-        transaction["_id"] = str(transaction["_id"])
-        transaction["service_request_id"] = str(transaction["service_request_id"])
-    return {"completed_transactions": transactions}
+    projection = build_projection("customer.get_completed_transactions", "transactions", "customer", fields)
+    cache_headers, not_modified = await versions.conditional(db, request, [versions.scope("transactions", "customer_id", str(user["_id"]))])
+    if not_modified:
+        return not_modified
+
+    transactions = await fetch_all(
+        db.transactions, {"customer_id": str(user["_id"]), "status": "completed"}, projection, archive=db[archive.TRANSACTIONS_ARCHIVE]
+    )
+    return BSONResponse({"completed_transactions": transactions}, headers=cache_headers)
 
 from fastapi import FastAPI, HTTPException, Depends
 from pydantic import BaseModel
@@ -1,153 +1,270 @@
-from fastapi import APIRouter, Depends, HTTPException
-from models import UserCreate, UserLogin, ServiceRequestModel
-from database import db
-from auth import hash_password, verify_password, create_access_token, get_current_user
+from fastapi import APIRouter, Depends, HTTPException, Request
+from models import UserCreate, UserLogin, ServiceRequestModel, InventoryUsageModel
+from database import async_db as db
+from auth import hash_password_async, check_password, create_access_token, get_current_user, get_event_stream_user, user_cache, create_event_ticket, EVENT_TICKET_EXPIRE_SECONDS
+from serialization import BSONResponse
+from bulk import check_batch_size
+from events import event_stream
+from pymongo.errors import DuplicateKeyError
+from pagination import build_filter, fetch_page, stream_ndjson
+from projection import build_projection
 from datetime import datetime
 from bson import ObjectId
 from pydantic import BaseModel
-import random
+from assignment import assigner
+import archive
+import dashboard
+import inventory
+import lifecycle
+import ratelimit
+import versions
+from typing import List, Optional
 
 router = APIRouter(prefix="/mechanic", tags=["Mechanic"])
 
 class UpdateRequestModel(BaseModel):
     update: str
 
-class InventoryUsageModel(BaseModel):
-    item_name: str
-    quantity_used: int
+class InventoryRecordModel(InventoryUsageModel):
+    service_request_id: str
 
 @router.post("/register")
-def register_mechanic(user: UserCreate):
-    if db.users.find_one({"email": user.email}):
+async def register_mechanic(user: UserCreate, request: Request):
+    await ratelimit.check_register(request, user.email)
+    # Cheap check before paying for the bcrypt hash
+    if await db.users.find_one({"email": user.email}, {"_id": 1}):
         raise HTTPException(status_code=400, detail="Mechanic already exists")
     user_data = user.dict()
-    user_data["password"] = hash_password(user.password)
+    user_data["password"] = await hash_password_async(user.password)
     user_data["role"] = "mechanic"
-    db.users.insert_one(user_data)
+    # The unique email index (required at startup) rejects a concurrent duplicate
+    try:
+        result = await db.users.insert_one(user_data)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="Mechanic already exists")
+    user_cache.invalidate(user.email)
+    assigner.add_mechanic(result.inserted_id, user.email)
     return {"message": "Mechanic registered successfully"}
 
 @router.post("/login")
-def login_mechanic(user: UserLogin):
-    found = db.users.find_one({"email": user.email, "role": "mechanic"})
-    if not found or not verify_password(user.password, found["password"]):
+async def login_mechanic(user: UserLogin, request: Request):
+    await ratelimit.check_login(request, user.email)
+    found = await db.users.find_one({"email": user.email, "role": "mechanic"})
+    if not found or not await check_password(found, user.password):
         raise HTTPException(status_code=401, detail="Invalid credentials")
     token = create_access_token({"sub": user.email, "role": "mechanic"})
     return {"access_token": token, "token_type": "bearer"}
 
 @router.get("/assigned_requests")
-def get_assigned_requests(user=Depends(get_current_user)):
+async def get_assigned_requests(request: Request, fields: Optional[str] = None, user=Depends(get_current_user)):
     if user["role"] != "mechanic":
         raise HTTPException(status_code=403, detail="Only mechanics can view assigned requests")
-    requests = list(db.service_requests.find({"mechanic_id": str(user["_id"])}))
-    for req in requests:
-        req["_id"] = str(req["_id"])
-        req["customer_id"] = str(req.get("customer_id", ""))
-        req["service_type"] = req.get("service_type", "N/A")  # Include service type
-        req["description"] = req.get("description", "N/A")  # Include description
-    return {"assigned_requests": requests}
+    projection = build_projection("mechanic.get_assigned_requests", "service_requests", "mechanic", fields)
+    cache_headers, not_modified = await versions.conditional(db, request, [versions.scope("service_requests", "mechanic_id", str(user["_id"]))])
+    if not_modified:
+        return not_modified
+    requests = await db.service_requests.find({"mechanic_id": str(user["_id"])}, projection).to_list(length=None)
+    return BSONResponse({"assigned_requests": requests}, headers=cache_headers)
+
+@router.get("/dashboard")
+async def get_dashboard(recent: int = 10, user=Depends(get_current_user)):
+    if user["role"] != "mechanic":
+        raise HTTPException(status_code=403, detail="Only mechanics can view their dashboard")
+    dashboard.check_recent(recent)
+    return BSONResponse(await dashboard.mechanic_dashboard(db, str(user["_id"]), recent))
+
+@router.post("/events/ticket")
+async def create_events_ticket(user=Depends(get_current_user)):
+    if user["role"] != "mechanic":
+        raise HTTPException(status_code=403, detail="Only mechanics can subscribe to assigned request events")
+    return {"ticket": create_event_ticket(user), "expires_in": EVENT_TICKET_EXPIRE_SECONDS}
+
+@router.get("/events")
+async def stream_events(user=Depends(get_event_stream_user)):
+    if user["role"] != "mechanic":
+        raise HTTPException(status_code=403, detail="Only mechanics can subscribe to assigned request events")
+    return event_stream(str(user["_id"]))
 
 @router.get("/completed_requests")
-def get_completed_requests(user=Depends(get_current_user)):
+async def get_completed_requests(
+    request: Request,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    created_after: Optional[datetime] = None,
+    created_before: Optional[datetime] = None,
+    fields: Optional[str] = None,
+    stream: bool = False,
+    user=Depends(get_current_user),
+):
     if user["role"] != "mechanic":
         raise HTTPException(status_code=403, detail="Only mechanics can view completed requests")
-    
-    # Fetch completed service requests assigned to the mechanic
-    requests = list(db.service_requests.find({"mechanic_id": str(user["_id"]), "status": "completed"}))
-    for req in requests:
-        req["_id"] = str(req["_id"])
-        req["customer_id"] = str(req.get("customer_id", ""))
-    return {"completed_requests": requests}
+    projection = build_projection("mechanic.get_completed_requests", "service_requests", "mechanic", fields)
+    cache_headers, not_modified = await versions.conditional(db, request, [versions.scope("service_requests", "mechanic_id", str(user["_id"]))])
+    if not_modified:
+        return not_modified
+
+    # Fetch completed service requests assigned to the mechanic from both tiers
+    query = build_filter({"mechanic_id": str(user["_id"])}, "completed", created_after, created_before)
+    archived = db[archive.SERVICE_REQUESTS_ARCHIVE]
+    if stream:
+        return stream_ndjson(db.service_requests, query, limit, cursor, projection, cache_headers, archive=archived)
+
+    requests, next_cursor = await fetch_page(db.service_requests, query, limit, cursor, projection, archive=archived)
+    return BSONResponse({"completed_requests": requests, "next_cursor": next_cursor}, headers=cache_headers)
 
 @router.post("/update_request_status/{request_id}")
-def update_request_status(request_id: str, status: str, user=Depends(get_current_user)):
+async def update_request_status(request_id: str, status: str, user=Depends(get_current_user)):
     if user["role"] != "mechanic":
         raise HTTPException(status_code=403, detail="Only mechanics can update request status")
-    result = db.service_requests.update_one(
+    previous = await db.service_requests.find_one_and_update(
         {"_id": ObjectId(request_id), "mechanic_id": str(user["_id"])},
-        {"$set": {"status": status, "updated_at": datetime.utcnow()}}
+        {"$set": {"status": status, "updated_at": datetime.utcnow()}},
+        projection=lifecycle.REQUEST_FIELDS
     )
-    if result.matched_count == 0:
+    if previous is None:
         raise HTTPException(status_code=404, detail="Service request not found or not assigned to this mechanic")
+    await lifecycle.status_changed(previous, status)
     return {"message": "Service request status updated"}
 
 @router.post("/submit_update/{request_id}")
-def submit_update(request_id: str, update_request: UpdateRequestModel, user=Depends(get_current_user)):
+async def submit_update(request_id: str, update_request: UpdateRequestModel, user=Depends(get_current_user)):
     if user["role"] != "mechanic":
         raise HTTPException(status_code=403, detail="Only mechanics can submit updates")
-    result = db.service_requests.update_one(
+    update_data = {"mechanic_update": update_request.update, "update_status": "pending_admin_verification", "updated_at": datetime.utcnow()}
+    previous = await db.service_requests.find_one_and_update(
         {"_id": ObjectId(request_id), "mechanic_id": str(user["_id"])},
-        {"$set": {"mechanic_update": update_request.update, "update_status": "pending_admin_verification"}}
+        {"$set": update_data},
+        projection=lifecycle.REQUEST_FIELDS
     )
-    if result.matched_count == 0:
+    if previous is None:
         raise HTTPException(status_code=404, detail="Service request not found or not assigned to this mechanic")
+    await lifecycle.request_updated(previous, update_data)
     return {"message": "Update submitted for admin verification"}
 
 @router.post("/record_inventory/{request_id}")
-def record_inventory(request_id: str, inventory_usage: InventoryUsageModel, user=Depends(get_current_user)):
+async def record_inventory(request_id: str, inventory_usage: InventoryUsageModel, user=Depends(get_current_user)):
     if user["role"] != "mechanic":
         raise HTTPException(status_code=403, detail="Only mechanics can record inventory usage")
-    
-    # Add the inventory usage to the inventory table
+    if not ObjectId.is_valid(request_id):
+        raise HTTPException(status_code=400, detail="Invalid service request id")
+    service_request = await db.service_requests.find_one(
+        {"_id": ObjectId(request_id), "mechanic_id": str(user["_id"])}, lifecycle.REQUEST_FIELDS
+    )
+    if service_request is None:
+        raise HTTPException(status_code=404, detail="Service request not found or not assigned to this mechanic")
+
+    # Take the items from stock and add the usage to the ledger
     inventory_data = inventory_usage.dict()
     inventory_data["mechanic_id"] = str(user["_id"])
     inventory_data["service_request_id"] = request_id
-    inventory_data["recorded_at"] = datetime.utcnow()
-    db.inventory.insert_one(inventory_data)
+    usage = await inventory.record_one(db, inventory_data)
+    await lifecycle.inventory_recorded(service_request, usage)
 
     return {"message": "Inventory usage recorded successfully"}
 
+@router.post("/bulk_record_inventory")
+async def bulk_record_inventory(records: List[InventoryRecordModel], user=Depends(get_current_user)):
+    if user["role"] != "mechanic":
+        raise HTTPException(status_code=403, detail="Only mechanics can record inventory usage")
+    check_batch_size(records)
+
+    results = [{"service_request_id": record.service_request_id} for record in records]
+    documents, doc_items = [], []
+    for index, record in enumerate(records):
+        if not ObjectId.is_valid(record.service_request_id):
+            results[index]["error"] = "Invalid service request id"
+            continue
+        inventory_data = record.dict()
+        inventory_data["mechanic_id"] = str(user["_id"])
+        documents.append(inventory_data)
+        doc_items.append(index)
+
+    if documents:
+        recorded, errors = await inventory.record_usage(db, documents)
+        for doc_index, index in enumerate(doc_items):
+            if errors[doc_index] is not None:
+                results[index]["error"] = errors[doc_index]
+            else:
+                results[index]["inserted_id"] = str(recorded[doc_index]["_id"])
+
+    inserted = sum(1 for result in results if "inserted_id" in result)
+    return {"inserted": inserted, "failed": len(records) - inserted, "results": results}
+
+@router.get("/inventory/stock")
+async def get_inventory_stock(item_name: Optional[str] = None, user=Depends(get_current_user)):
+    if user["role"] != "mechanic":
+        raise HTTPException(status_code=403, detail="Only mechanics can view inventory stock")
+    return BSONResponse({"stock": await inventory.stock_levels(db, item_name)})
+
 @router.post("/schedule_service")
-def schedule_service(request: ServiceRequestModel, user=Depends(get_current_user)):
+async def schedule_service(request: ServiceRequestModel, user=Depends(get_current_user)):
     if user["role"] != "customer":
         raise HTTPException(status_code=403, detail="Only customers can schedule services")
 
-    # Fetch all mechanics
-    mechanics = list(db.users.find({"role": "mechanic"}))
-    if not mechanics:
+    # Assign the mechanic with the fewest open requests
+    selected_mechanic = assigner.assign()
+    if selected_mechanic is None:
         raise HTTPException(status_code=404, detail="No mechanics available to assign the task")
-
-    # Randomly select a mechanic
-    selected_mechanic = random.choice(mechanics)
+    mechanic_id, mechanic_email = selected_mechanic
 
     # Insert service request details
     request_data = request.dict()
     request_data["customer_id"] = str(user["_id"])
-    request_data["mechanic_id"] = str(selected_mechanic["_id"])
+    request_data["mechanic_id"] = mechanic_id
     request_data["status"] = "pending"
-    request_data["created_at"] = datetime.utcnow()
-    db.service_requests.insert_one(request_data)
+    request_data["created_at"] = request_data["updated_at"] = datetime.utcnow()
+    try:
+        await db.service_requests.insert_one(request_data)
+    except Exception:
+        assigner.release(mechanic_id)
+        raise
+    await lifecycle.request_created(request_data)
 
-    return {"message": "Service request submitted successfully", "mechanic": selected_mechanic["email"]}
+    return {"message": "Service request submitted successfully", "mechanic": mechanic_email}
 
 @router.get("/service_requests")
-def get_all_service_requests(user=Depends(get_current_user)):
+async def get_all_service_requests(
+    request: Request,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    status: Optional[str] = None,
+    created_after: Optional[datetime] = None,
+    created_before: Optional[datetime] = None,
+    fields: Optional[str] = None,
+    stream: bool = False,
+    user=Depends(get_current_user),
+):
     if user["role"] != "admin":
         raise HTTPException(status_code=403, detail="Only admins can view service requests")
-    
-    # Fetch all service requests
-    requests = list(db.service_requests.find())
-    for req in requests:
-        req["_id"] = str(req["_id"])
-        req["customer_id"] = str(req.get("customer_id", ""))
-        req["service_type"] = req.get("service_type", "N/A")
-        req["description"] = req.get("description", "N/A")
-        req["inventories"] = req.get("inventories", [])  # Ensure inventories are included
-    return {"service_requests": requests}
+    projection = build_projection("mechanic.get_all_service_requests", "service_requests", "admin", fields)
+    cache_headers, not_modified = await versions.conditional(db, request, [versions.scope("service_requests")])
+    if not_modified:
+        return not_modified
+
+    query = build_filter({}, status, created_after, created_before)
+    if stream:
+        return stream_ndjson(db.service_requests, query, limit, cursor, projection, cache_headers)
+
+    # Fetch one page of service requests
+    requests, next_cursor = await fetch_page(db.service_requests, query, limit, cursor, projection)
+    return BSONResponse({"service_requests": requests, "next_cursor": next_cursor}, headers=cache_headers)
 
 @router.post("/mark_as_complete/{request_id}")
-def mark_as_complete(request_id: str, user=Depends(get_current_user)):
+async def mark_as_complete(request_id: str, user=Depends(get_current_user)):
     if user["role"] != "mechanic":
         raise HTTPException(status_code=403, detail="Only mechanics can mark services as complete")
 
-    # Check if the service request exists
-    service_request = db.service_requests.find_one({"_id": ObjectId(request_id)})
-    if not service_request:
-        raise HTTPException(status_code=404, detail="Service request not found")
-
-    # Update the service request status to "completed"
-    db.service_requests.update_one(
-        {"_id": ObjectId(request_id)},
-        {"$set": {"status": "completed", "updated_at": datetime.utcnow()}}
+    # Complete the request only if it is assigned to this mechanic and still open
+    request_query = {"_id": ObjectId(request_id), "mechanic_id": str(user["_id"])}
+    previous = await db.service_requests.find_one_and_update(
+        {**request_query, **lifecycle.OPEN},
+        {"$set": {"status": "completed", "updated_at": datetime.utcnow()}},
+        projection=lifecycle.REQUEST_FIELDS
     )
+    if previous is None:
+        await lifecycle.raise_transition_error(
+            request_query, "Service request not found or not assigned to this mechanic", "Service request is already closed"
+        )
+    await lifecycle.status_changed(previous, "completed")
 
     return {"message": "Service marked as complete"}
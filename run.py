@@ -1,7 +1,24 @@
-from app import create_app
-from app.extensions import socketio
+import os
 
-app = create_app()
+import uvicorn
 
+# Production entry point: one event loop per worker process, each with its own
+# Mongo client opened in the app lifespan. loop/http "auto" pick uvloop and
+# httptools when they are installed (pip install "uvicorn[standard]").
 if __name__ == "__main__":
-    socketio.run(app, host="0.0.0.0", port=5000, debug=True, allow_unsafe_werkzeug=True)
+    uvicorn.run(
+        "main:app",
+        host=os.getenv("HOST", "0.0.0.0"),
+        port=int(os.getenv("PORT", "8000")),
+        # More than one worker needs EVENT_SOURCE=change_stream and RATE_LIMIT_BACKEND=mongo,
+        # and multiplies the bcrypt pool by the worker count (see main.lifespan)
+        workers=int(os.getenv("WEB_CONCURRENCY", "1")),
+        loop=os.getenv("UVICORN_LOOP", "auto"),
+        http=os.getenv("UVICORN_HTTP", "auto"),
+        proxy_headers=True,
+        forwarded_allow_ips=os.getenv("FORWARDED_ALLOW_IPS", "127.0.0.1"),
+        timeout_keep_alive=int(os.getenv("KEEP_ALIVE_TIMEOUT_SECONDS", "5")),
+        # In-flight requests get this long to finish on SIGTERM; open SSE streams hold it to the end
+        timeout_graceful_shutdown=int(os.getenv("GRACEFUL_SHUTDOWN_TIMEOUT_SECONDS", "30")),
+        log_level=os.getenv("LOG_LEVEL", "info"),
+    )
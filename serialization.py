@@ -0,0 +1,24 @@
+from decimal import Decimal
+
+import orjson
+from bson import Decimal128, ObjectId
+from fastapi.responses import JSONResponse
+
+# orjson encodes dicts, lists, str, numbers and datetimes natively; this hook is only
+# called for the BSON types it does not know, so no per-field Python loops are needed
+def _encode_bson(value):
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, Decimal128):
+        return float(value.to_decimal())
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+def dumps(content) -> bytes:
+    return orjson.dumps(content, default=_encode_bson, option=orjson.OPT_NON_STR_KEYS)
+
+# Return this directly from a route to skip FastAPI's jsonable_encoder pass over raw Mongo documents
+class BSONResponse(JSONResponse):
+    def render(self, content) -> bytes:
+        return dumps(content)
@@ -0,0 +1,116 @@
+"""Regression test for the number of Mongo commands /customer/service_requests
+issues: one aggregation whatever the number of requests the customer owns,
+instead of one transactions lookup per request.
+
+Needs a real mongod (mongomock cannot run a $lookup with let); it is skipped
+when none answers at MONGO_TEST_URI, unless MONGO_TEST_REQUIRED is set (as in
+CI, which starts a mongo service), where a missing mongod fails the run.
+
+    MONGO_TEST_URI=mongodb://localhost:27017 python -m unittest discover tests
+"""
+import os
+import sys
+import threading
+import unittest
+from collections import Counter
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+TEST_URI = os.getenv("MONGO_TEST_URI", "mongodb://localhost:27017")
+TEST_REQUIRED = bool(os.getenv("MONGO_TEST_REQUIRED"))
+os.environ["MONGO_URI"] = TEST_URI
+os.environ["MONGO_DB_NAME"] = "vscms_command_counts_test"
+os.environ.setdefault("SECRET_KEY", "test-secret")
+os.environ.setdefault("ALGORITHM", "HS256")
+
+from bson import ObjectId  # noqa: E402
+from pymongo import MongoClient, monitoring  # noqa: E402
+from pymongo.errors import PyMongoError  # noqa: E402
+from starlette.requests import Request  # noqa: E402
+
+class CommandRecorder(monitoring.CommandListener):
+    def __init__(self):
+        self.commands = []
+        self._lock = threading.Lock()
+
+    def started(self, event):
+        with self._lock:
+            self.commands.append((event.command_name, event.command.get(event.command_name)))
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+# Must be registered before the app's client is created
+recorder = CommandRecorder()
+monitoring.register(recorder)
+
+from database import async_db  # noqa: E402
+from routes import customer  # noqa: E402
+
+def setUpModule():
+    try:
+        MongoClient(TEST_URI, serverSelectionTimeoutMS=500).admin.command("ping")
+    except PyMongoError as e:
+        if TEST_REQUIRED:
+            raise
+        raise unittest.SkipTest(f"no mongod at {TEST_URI}: {e}")
+
+def tearDownModule():
+    client = MongoClient(TEST_URI)
+    client.drop_database(os.environ["MONGO_DB_NAME"])
+    client.close()
+
+def list_request():
+    return Request({"type": "http", "method": "GET", "path": "/customer/service_requests", "query_string": b"", "headers": []})
+
+class CustomerRequestsCommandCountTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        for name in ("service_requests", "transactions", "versions"):
+            await async_db[name].drop()
+        self.customer = {"_id": ObjectId(), "role": "customer"}
+
+    async def asyncTearDown(self):
+        # The client belongs to this test's event loop
+        async_db.close()
+
+    async def seed(self, requests, paid):
+        docs = [
+            {"_id": ObjectId(), "customer_id": str(self.customer["_id"]), "mechanic_id": "m", "service_type": "Oil change",
+             "status": "pending", "created_at": datetime.utcnow(), "updated_at": datetime.utcnow()}
+            for _ in range(requests)
+        ]
+        await async_db.service_requests.insert_many(docs)
+        if paid:
+            await async_db.transactions.insert_many([
+                {"service_request_id": str(doc["_id"]), "customer_id": str(self.customer["_id"]), "amount": 10.0, "status": "completed"}
+                for doc in docs[:paid]
+            ])
+
+    async def commands_for_list(self):
+        recorder.commands.clear()
+        response = await customer.get_customer_requests(list_request(), user=self.customer)
+        return Counter(recorder.commands), response
+
+    async def test_one_aggregation_for_one_request(self):
+        await self.seed(1, paid=0)
+        commands, response = await self.commands_for_list()
+        self.assertEqual(commands[("aggregate", "service_requests")], 1)
+        self.assertEqual(commands[("find", "transactions")], 0)
+        self.assertEqual(sum(commands.values()), 2)  # list versions + the aggregation
+        self.assertIn(b'"service_requests":[{', response.body)
+
+    async def test_command_count_does_not_grow_with_requests(self):
+        await self.seed(1, paid=0)
+        single, _ = await self.commands_for_list()
+        await async_db.service_requests.drop()
+        # Stays within the first aggregate batch (101 documents), so no getMore either
+        await self.seed(100, paid=40)
+        many, response = await self.commands_for_list()
+        self.assertEqual(many, single)
+        self.assertEqual(response.body.count(b'"service_type"'), 60)
+
+if __name__ == "__main__":
+    unittest.main()
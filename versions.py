@@ -0,0 +1,58 @@
+import hashlib
+
+from fastapi import Response
+from pymongo import UpdateOne
+
+# Version counters behind the ETags of the list routes. Every write that can
+# change a list bumps the counter of each scope it touches (the whole collection
+# and the owning customer/mechanic), so a list can be revalidated by reading a
+# few counters instead of the documents.
+VERSIONS = "versions"
+OWNER_FIELDS = {
+    "service_requests": ("customer_id", "mechanic_id"),
+    "transactions": ("customer_id",),
+}
+
+def scope(collection, owner_field=None, owner_id=None):
+    if owner_field is None:
+        return collection
+    return f"{collection}:{owner_field}:{owner_id}"
+
+def document_scopes(collection, document):
+    scopes = [scope(collection)]
+    for field in OWNER_FIELDS[collection]:
+        if document.get(field):
+            scopes.append(scope(collection, field, document[field]))
+    return scopes
+
+async def bump(db, scopes):
+    scopes = list(dict.fromkeys(scopes))
+    if scopes:
+        await db[VERSIONS].bulk_write(
+            [UpdateOne({"_id": name}, {"$inc": {"version": 1}}, upsert=True) for name in scopes],
+            ordered=False,
+        )
+
+def _etag(request, scopes, found):
+    digest = hashlib.sha1(request.url.path.encode())
+    for key, value in sorted(request.query_params.multi_items()):
+        digest.update(f"\0{key}={value}".encode())
+    for name in scopes:
+        digest.update(f"\0{name}@{found.get(name, 0)}".encode())
+    return f'W/"{digest.hexdigest()}"'
+
+def _matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates or etag[2:] in candidates
+
+async def conditional(db, request, scopes):
+    # Returns the cache headers for the response and, when the client's copy is
+    # still current, a ready 304 so the route can skip the query entirely
+    docs = await db[VERSIONS].find({"_id": {"$in": scopes}}).to_list(length=None)
+    found = {doc["_id"]: doc["version"] for doc in docs}
+    headers = {"ETag": _etag(request, scopes, found), "Cache-Control": "private, no-cache"}
+    if _matches(request.headers.get("if-none-match"), headers["ETag"]):
+        return headers, Response(status_code=304, headers=headers)
+    return headers, None